@@ -42,6 +42,10 @@ try:
     import struct
 except ImportError:
     import ustruct as struct
+try:
+    from collections import namedtuple
+except ImportError:
+    from ucollections import namedtuple
 
 #    I2C ADDRESS/BITS/SETTINGS
 #    -----------------------------------------------------------------------
@@ -71,6 +75,15 @@ _BME680_FILTERSIZES = (0, 1, 3, 7, 15, 31, 63, 127)
 
 _BME680_RUNGAS = const(0x10)
 
+_BME680_HEATER_STEPS = const(10)
+
+# Largest register burst written from the preallocated buffer (10 heater slots)
+_MAX_BURST = const(10)
+
+# Measured temperature drift (degrees C) from the ambient temperature the heater
+# resistances were computed for that makes collect() recompute them
+_HEATER_AMBIENT_DRIFT = const(3)
+
 _LOOKUP_TABLE_1 = (2147483647.0, 2147483647.0, 2147483647.0, 2147483647.0, 2147483647.0,
                    2126008810.0, 2147483647.0, 2130303777.0, 2147483647.0, 2147483647.0,
                    2143188679.0, 2136746228.0, 2147483647.0, 2126008810.0, 2147483647.0,
@@ -81,6 +94,30 @@ _LOOKUP_TABLE_2 = (4096000000.0, 2048000000.0, 1024000000.0, 512000000.0, 255744
                    500000.0, 250000.0, 125000.0)
 
 
+BME680Reading = namedtuple("BME680Reading", ("temperature", "humidity", "pressure", "gas", "ticks_ms",
+                                             "gas_step", "gas_valid", "heat_stable"))
+"""Immutable result of one measurement: degrees C, RH %, hPa, ohms and the ``time.ticks_ms()``
+   at which it completed, then the heater profile step that produced the gas value and
+   whether the gas conversion was valid and the heater had reached its target temperature.
+   Gas values are only comparable between readings of the same step with both flags set."""
+
+
+def _encode_gas_wait(duration_ms):
+    """Shortest GAS_WAIT register encoding of at least duration_ms (max 4032 ms)"""
+    if duration_ms >= 0x3F * 64:
+        return 0xFF
+    factor = 0
+    while duration_ms > 0x3F:
+        duration_ms = (duration_ms + 3) // 4
+        factor += 1
+    return (factor << 6) | duration_ms
+
+
+def _decode_gas_wait(value):
+    """Heater duration in ms encoded in a GAS_WAIT register: 6-bit value times 1, 4, 16 or 64"""
+    return (value & 0x3F) * (1 << (2 * (value >> 6)))
+
+
 def _read24(arr):
     """Parse an unsigned 24-bit value as a floating point and return it."""
     ret = 0.0
@@ -94,6 +131,9 @@ def _read24(arr):
 class Adafruit_BME680:
     """Driver from BME680 air quality sensor
 
+       Use :meth:`read_all` to get temperature, humidity, pressure and gas from a single
+       measurement. The individual properties return values from the last snapshot.
+
        :param int refresh_rate: Maximum number of readings per second. Faster property reads
          will be from the previous reading."""
     def __init__(self, *, refresh_rate=10):
@@ -101,6 +141,8 @@ class Adafruit_BME680:
            reads."""
         self._write(_BME680_REG_SOFTRESET, [0xB6])
         time.sleep(0.005)
+        # Last value written to each configuration register (the reset cleared them)
+        self._reg_cache = {}
 
         # Check device ID.
         chip_id = self._read_byte(_BME680_REG_CHIPID)
@@ -109,9 +151,13 @@ class Adafruit_BME680:
 
         self._read_calibration()
 
+        self._snapshot = None
+        self._heater_profile = None
+        self._heater_step = 0
+        self._heater_ambient = 25
+
         # set up heater
-        self._write(_BME680_BME680_RES_HEAT_0, [0x73])
-        self._write(_BME680_BME680_GAS_WAIT_0, [0x65])
+        self.set_heater_profile(((320, 150),))
 
         self.sea_level_pressure = 1013.25
         """Pressure in hectoPascals at sea level. Used to calibrate ``altitude``."""
@@ -127,7 +173,13 @@ class Adafruit_BME680:
         self._adc_hum = None
         self._adc_gas = None
         self._gas_range = None
+        self._gas_index = 0
+        self._gas_valid = False
+        self._heat_stable = False
         self._t_fine = None
+        self._data = bytearray(15)  # status + raw data frame, reused for every reading
+        self._measuring = False
+        self._ready_at = 0
 
         self._last_reading = time.ticks_ms()
         self._min_refresh_time = 1000 // refresh_rate
@@ -183,14 +235,166 @@ class Adafruit_BME680:
     @property
     def temperature(self):
         """The compensated temperature in degrees celsius."""
-        self._perform_reading()
-        calc_temp = (((self._t_fine * 5) + 128) / 256)
-        return calc_temp / 100
+        return self._current_reading().temperature
 
     @property
     def pressure(self):
         """The barometric pressure in hectoPascals"""
+        return self._current_reading().pressure
+
+    @property
+    def humidity(self):
+        """The relative humidity in RH %"""
+        return self._current_reading().humidity
+
+    @property
+    def altitude(self):
+        """The altitude based on current ``pressure`` vs the sea level pressure
+           (``sea_level_pressure``) - which you must enter ahead of time)"""
+        pressure = self.pressure # in Si units for hPascal
+        return 44330.77 * (1.0 - math.pow(pressure / self.sea_level_pressure, 0.1902632))
+
+    @property
+    def gas(self):
+        """The gas resistance in ohms"""
+        return self._current_reading().gas
+
+    @property
+    def last_reading(self):
+        """The most recent :class:`BME680Reading`, or None before the first measurement"""
+        return self._snapshot
+
+    def read_all(self):
+        """Perform one single-shot measurement and return all values compensated from that
+           same raw frame as an immutable :class:`BME680Reading`."""
         self._perform_reading()
+        return self._snapshot
+
+    @property
+    def heater_profile(self):
+        """The programmed heater steps as a tuple of (target degrees C, duration ms), with
+           durations as actually encoded in the GAS_WAIT registers"""
+        return self._heater_profile
+
+    @property
+    def heater_step(self):
+        """Index of the heater profile step used by the next measurement"""
+        return self._heater_step
+
+    def set_heater_profile(self, steps, ambient_temperature=None):
+        """Program the gas heater from target temperatures using the chip calibration.
+
+           :param steps: Sequence of (target degrees C, duration ms) pairs, at most 10. With
+             more than one step each measurement uses the next step in turn.
+           :param float ambient_temperature: Ambient temperature for the resistance
+             calculation; defaults to the last measured temperature, or 25. The
+             resistances are recomputed whenever a measurement drifts more than a few
+             degrees from it."""
+        if not 0 < len(steps) <= _BME680_HEATER_STEPS:
+            raise RuntimeError("Invalid heater profile")
+        if ambient_temperature is None:
+            ambient_temperature = self._snapshot.temperature if self._snapshot else 25
+        gas_wait = [_encode_gas_wait(duration) for _, duration in steps]
+        self._write(_BME680_BME680_GAS_WAIT_0, gas_wait)
+        self._heater_profile = tuple((steps[i][0], _decode_gas_wait(gas_wait[i]))
+                                     for i in range(len(steps)))
+        self._heater_step = 0
+        self._write_res_heat(ambient_temperature)
+
+    def _write_res_heat(self, ambient_temperature):
+        """Program the heater resistance of every profile step for an ambient temperature"""
+        res_heat = [self._calc_res_heat(target, ambient_temperature)
+                    for target, _ in self._heater_profile]
+        self._write(_BME680_BME680_RES_HEAT_0, res_heat)
+        self._heater_ambient = ambient_temperature
+
+    def _calc_res_heat(self, target_temperature, ambient_temperature):
+        """Heater resistance register value for a target temperature (Bosch float formula)"""
+        target = min(target_temperature, 400)
+        heat_val = self._heat_val - 256 if self._heat_val > 127 else self._heat_val
+        var1 = (self._gas_calibration[0] / 16.0) + 49.0
+        var2 = ((self._gas_calibration[1] / 32768.0) * 0.0005) + 0.00235
+        var3 = self._gas_calibration[2] / 1024.0
+        var4 = var1 * (1.0 + (var2 * target))
+        var5 = var4 + (var3 * ambient_temperature)
+        res_heat = 3.4 * ((var5 * (4.0 / (4.0 + self._heat_range)) *
+                           (1.0 / (1.0 + (heat_val * 0.002)))) - 25)
+        return max(0, min(255, int(res_heat)))
+
+    def measurement_duration_ms(self):
+        """Expected duration of one forced-mode measurement in milliseconds: the
+           temperature/pressure/humidity conversions plus the gas heater wait."""
+        cycles = (_BME680_SAMPLERATES[self._temp_oversample] +
+                  _BME680_SAMPLERATES[self._pressure_oversample] +
+                  _BME680_SAMPLERATES[self._humidity_oversample])
+        # 1963 us per conversion cycle, TPH switching, gas measurement and wake up
+        # overhead as in the Bosch reference driver
+        duration_us = cycles * 1963 + 477 * 4 + 477 * 5 + 500
+        return duration_us // 1000 + 1 + self._heater_profile[self._heater_step][1]
+
+    def start_measurement(self):
+        """Trigger a single-shot measurement and return immediately.
+
+           :return: the ``time.ticks_ms()`` value at which the result is expected to be
+             ready; call :meth:`collect` after that."""
+        # Oversampling, filter and gas settings only go on the bus when they changed
+        self._update_config()
+        # Trigger single shot: CTRL_MEAS holds the T/P oversampling next to the mode bits
+        self._write_byte(_BME680_REG_CTRL_MEAS,
+                         (self._temp_oversample << 5) | (self._pressure_oversample << 2) | 0x01)
+        self._measuring = True
+        self._ready_at = time.ticks_add(time.ticks_ms(), self.measurement_duration_ms())
+        return self._ready_at
+
+    def collect(self, retrigger=False):
+        """Return the result of the measurement started with :meth:`start_measurement`
+           without blocking.
+
+           :param bool retrigger: Start the next measurement as soon as this one is
+             collected, so a fresh result is ready by the time it is needed.
+           :return: a :class:`BME680Reading`, or None if the measurement is not ready yet."""
+        if not self._measuring:
+            raise RuntimeError("No measurement started")
+        # No bus traffic before the conversion can possibly be done
+        if time.ticks_diff(self._ready_at, time.ticks_ms()) > 0:
+            return None
+        data = self._data
+        self._read_into(_BME680_REG_MEAS_STATUS, data)
+        if not data[0] & 0x80:
+            return None
+        self._measuring = False
+        self._last_reading = time.ticks_ms()
+        self._parse_frame(data)
+        # Multi-step profiles cycle through the heater slots, one per measurement
+        self._heater_step = (self._heater_step + 1) % len(self._heater_profile)
+        temperature = self._compensate_temperature()
+        self._snapshot = BME680Reading(temperature,
+                                       self._compensate_humidity(),
+                                       self._compensate_pressure(),
+                                       self._compensate_gas(),
+                                       self._last_reading,
+                                       self._gas_index,
+                                       self._gas_valid,
+                                       self._heat_stable)
+        # The heater resistance for a target temperature depends on the ambient one
+        if abs(temperature - self._heater_ambient) > _HEATER_AMBIENT_DRIFT:
+            self._write_res_heat(temperature)
+        if retrigger:
+            self.start_measurement()
+        return self._snapshot
+
+    def _current_reading(self):
+        """Return the last snapshot, measuring again only if it is older than the refresh time"""
+        if (self._snapshot is None or
+                time.ticks_diff(time.ticks_ms(), self._last_reading) >= self._min_refresh_time):
+            return self.read_all()
+        return self._snapshot
+
+    def _compensate_temperature(self):
+        calc_temp = (((self._t_fine * 5) + 128) / 256)
+        return calc_temp / 100
+
+    def _compensate_pressure(self):
         var1 = (self._t_fine / 2) - 64000
         var2 = ((var1 / 4) * (var1 / 4)) / 2048
         var2 = (var2 * self._pressure_calibration[5]) / 4
@@ -210,10 +414,7 @@ class Adafruit_BME680:
         calc_pres += ((var1 + var2 + var3 + (self._pressure_calibration[6] * 128)) / 16)
         return calc_pres/100
 
-    @property
-    def humidity(self):
-        """The relative humidity in RH %"""
-        self._perform_reading()
+    def _compensate_humidity(self):
         temp_scaled = ((self._t_fine * 5) + 128) / 256
         var1 = ((self._adc_hum - (self._humidity_calibration[0] * 16)) -
                 ((temp_scaled * self._humidity_calibration[2]) / 200))
@@ -235,17 +436,7 @@ class Adafruit_BME680:
             calc_hum = 0
         return calc_hum
 
-    @property
-    def altitude(self):
-        """The altitude based on current ``pressure`` vs the sea level pressure
-           (``sea_level_pressure``) - which you must enter ahead of time)"""
-        pressure = self.pressure # in Si units for hPascal
-        return 44330.77 * (1.0 - math.pow(pressure / self.sea_level_pressure, 0.1902632))
-
-    @property
-    def gas(self):
-        """The gas resistance in ohms"""
-        self._perform_reading()
+    def _compensate_gas(self):
         var1 = ((1340 + (5 * self._sw_err)) * (_LOOKUP_TABLE_1[self._gas_range])) / 65536
         var2 = ((self._adc_gas * 32768) - 16777216) + var1
         var3 = (_LOOKUP_TABLE_2[self._gas_range] * var1) / 512
@@ -253,37 +444,34 @@ class Adafruit_BME680:
         return int(calc_gas_res)
 
     def _perform_reading(self):
-        """Perform a single-shot reading from the sensor and fill internal data structure for
-           calculations"""
+        """Perform a single-shot reading from the sensor, blocking until it is done, and
+           update the snapshot"""
         expired = time.ticks_diff(self._last_reading, time.ticks_ms()) * time.ticks_diff(0, 1)
         if 0 <= expired < self._min_refresh_time:
             time.sleep_ms(self._min_refresh_time - expired)
 
-        # set filter
-        self._write(_BME680_REG_CONFIG, [self._filter << 2])
-        # turn on temp oversample & pressure oversample
-        self._write(_BME680_REG_CTRL_MEAS,
-                    [(self._temp_oversample << 5)|(self._pressure_oversample << 2)])
-        # turn on humidity oversample
-        self._write(_BME680_REG_CTRL_HUM, [self._humidity_oversample])
-        # gas measurements enabled
-        self._write(_BME680_REG_CTRL_GAS, [_BME680_RUNGAS])
-
-        ctrl = self._read_byte(_BME680_REG_CTRL_MEAS)
-        ctrl = (ctrl & 0xFC) | 0x01  # enable single shot!
-        self._write(_BME680_REG_CTRL_MEAS, [ctrl])
-        new_data = False
-        while not new_data:
-            data = self._read(_BME680_REG_MEAS_STATUS, 15)
-            new_data = data[0] & 0x80 != 0
-            time.sleep(0.005)
-        self._last_reading = time.ticks_ms()
-
-        self._adc_pres = _read24(data[2:5]) / 16
-        self._adc_temp = _read24(data[5:8]) / 16
-        self._adc_hum = struct.unpack('>H', bytes(data[8:10]))[0]
-        self._adc_gas = int(struct.unpack('>H', bytes(data[13:15]))[0] / 64)
+        if not self._measuring:
+            self.start_measurement()
+        while True:
+            wait = time.ticks_diff(self._ready_at, time.ticks_ms())
+            if wait > 0:
+                time.sleep_ms(wait)
+            if self.collect() is not None:
+                return
+            # Conversion took a little longer than computed: poll again shortly
+            self._ready_at = time.ticks_add(time.ticks_ms(), 5)
+
+    def _parse_frame(self, data):
+        """Extract the raw ADC values from a status + data frame and compute t_fine"""
+        # Assembled from single bytes: slicing the frame would allocate on every sample
+        self._adc_pres = ((data[2] << 16) | (data[3] << 8) | data[4]) / 16
+        self._adc_temp = ((data[5] << 16) | (data[6] << 8) | data[7]) / 16
+        self._adc_hum = (data[8] << 8) | data[9]
+        self._adc_gas = ((data[13] << 8) | data[14]) >> 6
         self._gas_range = data[14] & 0x0F
+        self._gas_index = data[0] & 0x0F              # heater step of this gas value
+        self._gas_valid = bool(data[14] & 0x20)       # gas_valid_r
+        self._heat_stable = bool(data[14] & 0x10)     # heat_stab_r
 
         var1 = (self._adc_temp / 8) - (self._temp_calibration[0] * 2)
         var2 = (var1 * self._temp_calibration[1]) / 2048
@@ -292,6 +480,19 @@ class Adafruit_BME680:
 
         self._t_fine = int(var2 + var3)
 
+    def _update_config(self):
+        """Write filter, humidity oversampling and gas control registers if they changed"""
+        self._write_cached(_BME680_REG_CONFIG, self._filter << 2)
+        self._write_cached(_BME680_REG_CTRL_HUM, self._humidity_oversample)
+        # nb_conv selects the heater profile slot for the next measurement
+        self._write_cached(_BME680_REG_CTRL_GAS, _BME680_RUNGAS | self._heater_step)
+
+    def _write_cached(self, register, value):
+        """Write a single register unless it already holds ``value`` from a previous write"""
+        if self._reg_cache.get(register) != value:
+            self._write_byte(register, value)
+            self._reg_cache[register] = value
+
     def _read_calibration(self):
         """Read & save the calibration coefficients"""
         coeff = self._read(_BME680_BME680_COEFF_ADDR1, 25)
@@ -318,6 +519,14 @@ class Adafruit_BME680:
         """Read a byte register value and return it"""
         return self._read(register, 1)[0]
 
+    def _read_into(self, register, buf):
+        """Read len(buf) bytes starting at the register into buf"""
+        buf[:] = self._read(register, len(buf))
+
+    def _write_byte(self, register, value):
+        """Write a single byte register value"""
+        self._write(register, [value])
+
     def _read(self, register, length):
         raise NotImplementedError()
 
@@ -337,22 +546,42 @@ class BME680_I2C(Adafruit_BME680):
         self._i2c = i2c
         self._address = address
         self._debug = debug
+        # Register/value pairs for burst writes, reused to avoid allocations
+        self._wbuf = bytearray(2 * _MAX_BURST)
+        self._wbuf_mv = memoryview(self._wbuf)
         super().__init__(refresh_rate=refresh_rate)
 
     def _read(self, register, length):
         """Returns an array of 'length' bytes from the 'register'"""
         result = bytearray(length)
-        self._i2c.readfrom_mem_into(self._address, register & 0xff, result)
-        if self._debug:
-            print("\t${:x} read ".format(register), " ".join(["{:02x}".format(i) for i in result]))
+        self._read_into(register, result)
         return result
 
-    def _write(self, register, values):
-        """Writes an array of 'length' bytes to the 'register'"""
+    def _read_into(self, register, buf):
+        """Read len(buf) bytes starting at the 'register' into 'buf'"""
+        self._i2c.readfrom_mem_into(self._address, register & 0xff, buf)
         if self._debug:
-            print("\t${:x} write".format(register), " ".join(["{:02x}".format(i) for i in values]))
-        for value in values:
-            self._i2c.writeto_mem(self._address, register, bytearray([value & 0xFF]))
-            register += 1
+            print("\t${:x} read ".format(register), " ".join(["{:02x}".format(i) for i in buf]))
 
+    def _write(self, register, values):
+        """Writes an array of 'length' bytes to the 'register' in one I2C transaction
 
+           The BME680 has no auto-increment for writes, so a burst is sent as
+           register/value pairs."""
+        if self._debug:
+            print("\t${:x} write".format(register), " ".join(["{:02x}".format(i) for i in values]))
+        n = len(values)
+        buf = self._wbuf if n <= _MAX_BURST else bytearray(2 * n)
+        for i in range(n):
+            buf[2 * i] = (register + i) & 0xFF
+            buf[2 * i + 1] = values[i] & 0xFF
+        self._i2c.writeto(self._address, self._wbuf_mv[:2 * n] if buf is self._wbuf else buf)
+
+    def _write_byte(self, register, value):
+        """Write a single byte register value without allocating"""
+        if self._debug:
+            print("\t${:x} write {:02x}".format(register, value))
+        buf = self._wbuf
+        buf[0] = register & 0xFF
+        buf[1] = value & 0xFF
+        self._i2c.writeto(self._address, self._wbuf_mv[:2])
@@ -0,0 +1,101 @@
+# checkpoint.py
+# Device state kept in RAM and checkpointed to flash only when it changed and
+# the checkpoint interval has passed, or when the caller forces it (before a
+# reboot, after an NTP sync). Each checkpoint is written to a temporary file
+# and renamed into place, rotating over a few slot files; loading picks the
+# newest slot that parses.
+
+import os
+import time
+import ujson
+
+
+class Checkpoint:
+    def __init__(self, name="state", slots=3, interval_s=600):
+        """
+        Args:
+            name: File name prefix; slots are <name>0.json, <name>1.json, ...
+            slots: Number of slot files written in rotation
+            interval_s: Minimum seconds between checkpoints of changed state
+        """
+        self.name = name
+        self.slots = slots
+        self.interval_ms = interval_s * 1000
+        self.values = {}
+        self.dirty = set()     # keys changed since the last checkpoint
+        self.seq = 0           # sequence number of the newest checkpoint
+        self.writes = 0
+        self.bytes_written = 0
+        self._last_save = time.ticks_ms()
+
+    def _path(self, slot):
+        return "%s%d.json" % (self.name, slot)
+
+    def load(self):
+        """
+        Restore the newest valid checkpoint into `values`.
+
+        Returns:
+            Dictionary of restored values, or None if no slot could be read
+        """
+        best = None
+        for slot in range(self.slots):
+            try:
+                with open(self._path(slot), "r") as f:
+                    data = ujson.load(f)
+                if best is None or data["seq"] > best["seq"]:
+                    best = data
+            except (OSError, ValueError, KeyError, TypeError):
+                pass
+        if best is None:
+            return None
+        self.seq = best["seq"]
+        self.values = best["values"]
+        self.dirty = set()
+        return self.values
+
+    def get(self, key, default=None):
+        return self.values.get(key, default)
+
+    def set(self, key, value):
+        """Update a value in RAM; nothing is written until the next checkpoint"""
+        if self.values.get(key) != value:
+            self.values[key] = value
+            self.dirty.add(key)
+
+    def due(self):
+        return bool(self.dirty) and time.ticks_diff(time.ticks_ms(), self._last_save) >= self.interval_ms
+
+    def maybe_save(self):
+        """Checkpoint if something changed and the interval has passed"""
+        if self.due():
+            return self.save()
+        return False
+
+    def save(self, force=False):
+        """
+        Write a checkpoint now (if anything changed, or always when `force` is set).
+
+        Returns:
+            True if a checkpoint was written
+        """
+        if not self.dirty and not force:
+            return False
+        seq = self.seq + 1
+        path = self._path(seq % self.slots)
+        tmp = path[:-5] + ".tmp"
+        text = ujson.dumps({"seq": seq, "values": self.values})
+        with open(tmp, "w") as f:
+            f.write(text)
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            # Filesystems that cannot rename over an existing file (FAT)
+            os.remove(path)
+            os.rename(tmp, path)
+        self.seq = seq
+        self.dirty = set()
+        self.writes += 1
+        self.bytes_written += len(text)
+        self._last_save = time.ticks_ms()
+        return True
@@ -0,0 +1,144 @@
+# compress.py
+# Per-field compression of the reading stream before it is stored or uploaded.
+# A point is kept only when the series cannot otherwise be rebuilt within the
+# tolerance of every field:
+#   DEADBAND       keep a reading when any field moved more than its tolerance
+#                  from the last kept one (rebuild: hold the last kept value)
+#   SWINGING_DOOR  keep the end points of straight segments that stay within
+#                  the tolerance (rebuild: linear interpolation between kept points)
+# A change of IAQ class and a maximum gap between kept points always keep a point.
+
+try:
+    import struct
+except ImportError:
+    import ustruct as struct
+
+from ring_log import RECORD_FMT
+
+DEADBAND = "deadband"
+SWINGING_DOOR = "swinging_door"
+
+FIELDS = ("temp", "hum", "pres", "gas")  # record fields 1..4; field 5 is the IAQ code
+_IAQ = 5
+
+
+class Compressor:
+    def __init__(self, tolerances, mode=SWINGING_DOOR, max_gap_s=600):
+        """
+        Args:
+            tolerances: Dict of field name -> (absolute, relative) tolerance; the larger
+                of absolute and relative * |value| applies (e.g., {"gas": (0, 0.02)})
+            mode: DEADBAND or SWINGING_DOOR
+            max_gap_s: A point is kept at least this often even if nothing changed
+        """
+        self.mode = mode
+        self.max_gap_s = max_gap_s
+        # Tuples and lists of floats rather than array("f"): reading an array
+        # element allocates a new float, and add() reads these for every field
+        self.abs_tol = tuple(float(tolerances.get(f, (0, 0))[0]) for f in FIELDS)
+        self.rel_tol = tuple(float(tolerances.get(f, (0, 0))[1]) for f in FIELDS)
+        self.received = 0
+        self.kept = 0
+        size = struct.calcsize(RECORD_FMT)
+        self._anchor = None               # values of the last kept point
+        self._held = bytearray(size)      # swinging door: newest point, not yet kept
+        self._held_values = None
+        self._lo = [0.0] * len(FIELDS)    # steepest lower door slope so far
+        self._hi = [0.0] * len(FIELDS)    # flattest upper door slope so far
+
+    @property
+    def ratio(self):
+        """Readings received per reading kept"""
+        return self.received / self.kept if self.kept else 1.0
+
+    def _tol(self, i, base):
+        return max(self.abs_tol[i], self.rel_tol[i] * abs(base))
+
+    def _keep(self, record, values, emit):
+        self._anchor = values
+        self.kept += 1
+        emit(record)
+
+    def add(self, record, values, emit):
+        """
+        Feed one sensor log record.
+
+        Args:
+            record: Packed record (RECORD_FMT)
+            values: The same record unpacked, as also given to the rollups
+            emit: Function called with each record to keep, oldest first (0, 1 or 2 per call)
+        """
+        self.received += 1
+        anchor = self._anchor
+        if anchor is None:
+            self._keep(record, values, emit)
+            return
+        if self.mode == DEADBAND:
+            if values[0] - anchor[0] >= self.max_gap_s or values[_IAQ] != anchor[_IAQ]:
+                self._keep(record, values, emit)
+                return
+            for i in range(len(FIELDS)):
+                if abs(values[i + 1] - anchor[i + 1]) > self._tol(i, anchor[i + 1]):
+                    self._keep(record, values, emit)
+                    return
+            return
+
+        held = self._held_values
+        dt = values[0] - anchor[0]
+        last = held if held is not None else anchor   # newest point seen before this one
+        if dt <= 0 or values[_IAQ] != last[_IAQ]:
+            # Clock stepped back, or the IAQ class changed: keep the last point
+            # before and the first point after
+            self.flush(emit)
+            self._keep(record, values, emit)
+            return
+        if held is not None:
+            # The segment can end at this point only if the line from the anchor
+            # to it passes every point since the anchor within its tolerance,
+            # i.e. its slope lies between the doors those points opened
+            closed = dt >= self.max_gap_s
+            for i in range(len(FIELDS)):
+                slope = (values[i + 1] - anchor[i + 1]) / dt
+                if slope < self._lo[i] or slope > self._hi[i]:
+                    closed = True
+                    break
+            if not closed:
+                self._narrow(anchor, values, dt)
+                self._hold(record, values)
+                return
+            # The door closed: keep the previous point and start a new segment from it
+            self.flush(emit)
+            anchor = self._anchor
+            dt = values[0] - anchor[0]
+            if dt <= 0:
+                self._keep(record, values, emit)
+                return
+        # First point of a segment: the doors open from the anchor through it
+        for i in range(len(FIELDS)):
+            self._lo[i] = -1e30
+            self._hi[i] = 1e30
+        self._narrow(anchor, values, dt)
+        self._hold(record, values)
+
+    def _narrow(self, anchor, values, dt):
+        """Close the doors to the slopes from the anchor that pass this point within tolerance"""
+        for i in range(len(FIELDS)):
+            tol = self._tol(i, values[i + 1])
+            lo = (values[i + 1] - tol - anchor[i + 1]) / dt
+            hi = (values[i + 1] + tol - anchor[i + 1]) / dt
+            if lo > self._lo[i]:
+                self._lo[i] = lo
+            if hi < self._hi[i]:
+                self._hi[i] = hi
+
+    def _hold(self, record, values):
+        held = self._held
+        for i in range(len(held)):
+            held[i] = record[i]
+        self._held_values = values
+
+    def flush(self, emit):
+        """Keep the held point, if any (e.g. before a reboot)"""
+        if self._held_values is not None:
+            self._keep(self._held, self._held_values, emit)
+            self._held_values = None
@@ -0,0 +1,50 @@
+# dst.py
+# DST-aware local time (Finland: EET/EEST), shared by the device and the
+# testing tools so both name local hours the same way
+
+import time
+
+_DAYS = (31, None, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+_WEEKDAY_T = (0, 3, 2, 5, 0, 3, 5, 1, 4, 6, 2, 4)
+_offset_day = [-1, 0]   # UTC day number and its offset, as last used by local_epoch
+
+
+def is_leap(year):
+    return (year % 4 == 0 and year % 100 != 0) or (year % 400 == 0)
+
+
+def days_in_month(year, month):
+    if month == 2: return 29 if is_leap(year) else 28
+    return _DAYS[month-1]
+
+
+def weekday(y, m, d):
+    if m < 3:
+        y -= 1
+    return (y + y//4 - y//100 + y//400 + _WEEKDAY_T[m-1] + d) % 7
+
+
+def last_sunday(year, month):
+    ld = days_in_month(year, month)
+    wd = weekday(year, month, ld)
+    return ld if wd == 0 else ld - wd
+
+
+def utc_offset_hours(utc):
+    year, month, day = utc[0], utc[1], utc[2]
+    dst_start_day = last_sunday(year, 3)
+    dst_end_day   = last_sunday(year, 10)
+    in_dst = (month > 3 and month < 10) or \
+             (month == 3 and day >= dst_start_day) or \
+             (month == 10 and day <= dst_end_day)
+    return 3 if in_dst else 2
+
+
+def local_epoch(utc_ts):
+    """Local epoch seconds for a UTC epoch (the offset only changes with the UTC date,
+    so it is worked out once per day instead of from a time tuple per call)"""
+    day = utc_ts // 86400
+    if day != _offset_day[0]:
+        _offset_day[0] = day
+        _offset_day[1] = utc_offset_hours(time.gmtime(utc_ts))
+    return utc_ts + _offset_day[1] * 3600
@@ -1,56 +1,409 @@
 # firebase_sync.py
 # Helper module for Firestore sync
 
-import urequests
-import ujson
+import os
+import time
+import socket
+try:
+    import ujson
+except ImportError:
+    import json as ujson  # CPython: testing/test_firebase.py shares the schemas below
+from ring_log import RingLog, RECORD_FMT
+from textbuf import TextBuffer
+from dst import local_epoch, utc_offset_hours
+try:
+    import ssl
+except ImportError:
+    import ussl as ssl
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+FIRESTORE_HOST = "firestore.googleapis.com"
+
+_ID_CHARS = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789"
+
+# Field kinds of a DocumentSchema
+STRING = 0
+INTEGER = 1
+DOUBLE = 2
+TIMESTAMP = 3  # UTC epoch seconds, stored as a "YYYY-MM-DDTHH:MM:SS" local time string
+
+_OPEN = (b'{"stringValue":"', b'{"integerValue":"', b'{"doubleValue":', b'{"stringValue":"')
+_CLOSE = (b'"}', b'"}', b'}', b'"}')
+
+
+def _timestamp_into(out, ts):
+    t = time.gmtime(local_epoch(ts))
+    out.integer(t[0], 4).text(b"-").integer(t[1], 2).text(b"-").integer(t[2], 2).text(b"T")
+    out.integer(t[3], 2).text(b":").integer(t[4], 2).text(b":").integer(t[5], 2)
+
+
+def _value_into(out, kind, value, decimals):
+    """Append one Firestore typed value"""
+    out.text(_OPEN[kind])
+    if kind == DOUBLE:
+        out.fixed(value, decimals)
+    elif kind == INTEGER:
+        out.integer(int(value))
+    elif kind == TIMESTAMP:
+        _timestamp_into(out, value)
+    else:
+        out.text(value.encode() if isinstance(value, str) else value)
+    out.text(_CLOSE[kind])
+
+
+def _check(out):
+    """Raise if the text did not fit: TextBuffer drops what does not fit"""
+    if out.n >= out.size:
+        raise ValueError("JSON does not fit in %d bytes" % out.size)
+    return out
+
+
+class DocumentSchema:
+    def __init__(self, fields, constants=()):
+        """
+        Firestore document layout compiled into byte templates once, so that
+        documents are serialized straight into a TextBuffer without building
+        dicts or JSON strings per upload.
+
+        Args:
+            fields: Sequence of (name, kind, source[, decimals]): Firestore field
+                name, STRING / INTEGER / DOUBLE / TIMESTAMP, index or key of the
+                value in a record (tuple or dict), and decimal places of a DOUBLE
+                (default 2). Names and STRING values must not need JSON escaping.
+            constants: Sequence of (name, kind, value) written into every document
+        """
+        self.names = tuple(f[0] for f in fields)
+        self.kinds = bytes([f[1] for f in fields])
+        self.sources = tuple(f[2] for f in fields)
+        self.decimals = bytes([f[3] if len(f) > 3 else 2 for f in fields])
+        self._heads = tuple(b'"' + f[0].encode() + b'":' for f in fields)
+        out = TextBuffer(64 * (len(fields) + len(constants) + 1))
+        for name, kind, value in constants:
+            out.text(b',"' if out.n else b'"').text(name.encode()).text(b'":')
+            _value_into(out, kind, value, 2)
+        self._constants = bytes(_check(out).view())
+        # The field names as an array value (column header of hour documents)
+        out.clear().text(b'{"arrayValue":{"values":[')
+        for i in range(len(fields)):
+            _value_into(out.text(b"," if i else b""), STRING, self.names[i], 0)
+        self.columns = bytes(_check(out.text(b"]}}")).view())
+
+    def value(self, values, i):
+        """Field i of a record as it is sent (DOUBLE rounded), e.g. to detect changes"""
+        v = values[self.sources[i]]
+        kind = self.kinds[i]
+        if kind == DOUBLE:
+            return round(v, self.decimals[i])
+        if kind == INTEGER:
+            return int(v)
+        return v
+
+    def _field_into(self, out, values, i):
+        _value_into(out, self.kinds[i], values[self.sources[i]], self.decimals[i])
+
+    def fields_into(self, out, values, select=None):
+        """Append the fields map {"name": {typed value}, ...} of a record (select: field positions to write)"""
+        out.text(b"{").text(self._constants)
+        first = not self._constants
+        for i in (range(len(self._heads)) if select is None else select):
+            out.text(b"" if first else b",").text(self._heads[i])
+            self._field_into(out, values, i)
+            first = False
+        return out.text(b"}")
+
+    def document_into(self, out, values, select=None):
+        """Append a document body {"fields": {...}} of a record"""
+        return self.fields_into(out.text(b'{"fields":'), values, select).text(b"}")
+
+    def row_into(self, out, values):
+        """Append the fields of a record as an array value, in schema order"""
+        out.text(b'{"arrayValue":{"values":[')
+        for i in range(len(self._heads)):
+            if i:
+                out.text(b",")
+            self._field_into(out, values, i)
+        return out.text(b"]}}")
+
+    def mask(self, select=None):
+        """updateMask query parameters naming the fields (select: field positions)"""
+        names = self.names
+        return "".join("&updateMask.fieldPaths=" + names[i]
+                       for i in (range(len(names)) if select is None else select))
+
+
+# Documents of one reading: a sensor log record (utc_ts, temp, hum, pres, gas, iaq_code)
+READING_SCHEMA = DocumentSchema((
+    ("timestamp", TIMESTAMP, 0),
+    ("temperature_C", DOUBLE, 1, 2),
+    ("humidity_percent", DOUBLE, 2, 2),
+    ("pressure_hPa", DOUBLE, 3, 1),
+    ("gas_ohms", INTEGER, 4),
+))
+
+# Rows of hour documents (FirebaseSync.send_hourly), from a sensor log record
+HOURLY_SCHEMA = DocumentSchema((
+    ("temperature_C", DOUBLE, 1, 2),
+    ("humidity_percent", DOUBLE, 2, 2),
+    ("pressure_hPa", DOUBLE, 3, 1),
+    ("gas_ohms", INTEGER, 4),
+))
+
+
+def bucket_schema(period_s, device_id):
+    """
+    Documents of one rollup bucket record (start, count, then min, max, mean of
+    temp, hum, pres, gas). The means keep the reading field names so readers of
+    reading documents also work on buckets; "device" names the device the
+    bucket came from, as in hour documents.
+    """
+    return DocumentSchema((
+        ("timestamp", TIMESTAMP, 0),
+        ("samples", INTEGER, 1),
+        ("temperature_C", DOUBLE, 4, 2),
+        ("temperature_min_C", DOUBLE, 2, 2),
+        ("temperature_max_C", DOUBLE, 3, 2),
+        ("humidity_percent", DOUBLE, 7, 2),
+        ("humidity_min_percent", DOUBLE, 5, 2),
+        ("humidity_max_percent", DOUBLE, 6, 2),
+        ("pressure_hPa", DOUBLE, 10, 1),
+        ("pressure_min_hPa", DOUBLE, 8, 1),
+        ("pressure_max_hPa", DOUBLE, 9, 1),
+        ("gas_ohms", INTEGER, 13),
+        ("gas_min_ohms", INTEGER, 11),
+        ("gas_max_ohms", INTEGER, 12),
+    ), (("device", STRING, device_id), ("period_s", INTEGER, period_s)))
+
+
+# The devices/<id> document (LatestDocument), from a dict with these keys
+LATEST_SCHEMA = DocumentSchema((
+    ("timestamp", TIMESTAMP, "ts"),
+    ("temperature_C", DOUBLE, "temp", 2),
+    ("humidity_percent", DOUBLE, "hum", 2),
+    ("pressure_hPa", DOUBLE, "pres", 1),
+    ("gas_ohms", INTEGER, "gas"),
+    ("iaq", STRING, "iaq"),
+    ("window_s", INTEGER, "window_s"),
+    ("samples", INTEGER, "samples"),
+    ("temperature_min_C", DOUBLE, "temp_min", 2),
+    ("temperature_max_C", DOUBLE, "temp_max", 2),
+    ("humidity_min_percent", DOUBLE, "hum_min", 2),
+    ("humidity_max_percent", DOUBLE, "hum_max", 2),
+    ("pressure_min_hPa", DOUBLE, "pres_min", 1),
+    ("pressure_max_hPa", DOUBLE, "pres_max", 1),
+    ("gas_min_ohms", INTEGER, "gas_min"),
+    ("gas_max_ohms", INTEGER, "gas_max"),
+))
+
+
+def _new_doc_id():
+    """Generate a random 20 character document ID like Firestore's auto IDs"""
+    return "".join(_ID_CHARS[b % len(_ID_CHARS)] for b in os.urandom(20))
+
+
+class _Response:
+    """Minimal urequests-style response returned by HttpsSession.request"""
+
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8")
+
+    def json(self):
+        return ujson.loads(self.content)
+
+    def close(self):
+        # The connection belongs to the session and stays open for reuse
+        pass
+
+
+class HttpsSession:
+    def __init__(self, host, port=443, timeout=10):
+        """
+        Reusable HTTP/1.1 keep-alive connection over TLS to a single host, on
+        uasyncio streams: other tasks keep running while the connection is set
+        up and while a response is awaited.
+
+        The resolved address is cached (DNS lookups block, so they only happen
+        for the first connection) and the TLS connection is kept open between
+        requests. If the server has closed an idle connection, the request is
+        retried once on a fresh connection.
+
+        Args:
+            host: Server host name (e.g., "firestore.googleapis.com")
+            port: TLS port
+            timeout: Seconds allowed for connecting, and for each request
+        """
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.handshakes = 0   # New TCP + TLS connections
+        self.reused = 0       # Requests served on an already open connection
+        self._addr = None     # IP address of host
+        self._ssl = None
+        self._reader = None
+        self._writer = None
+
+    async def _connect(self):
+        if self._addr is None:
+            self._addr = socket.getaddrinfo(self.host, self.port, 0, socket.SOCK_STREAM)[0][-1][0]
+        if self._ssl is None:
+            # No CA bundle on the device: encrypted but unverified, as before
+            self._ssl = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+            if hasattr(self._ssl, "check_hostname"):
+                self._ssl.check_hostname = False
+            self._ssl.verify_mode = ssl.CERT_NONE
+        try:
+            self._reader, self._writer = await asyncio.wait_for(
+                asyncio.open_connection(self._addr, self.port, ssl=self._ssl, server_hostname=self.host),
+                self.timeout)
+        except Exception:
+            self._addr = None  # resolve again next time in case the address changed
+            raise
+        self.handshakes += 1
+
+    def close(self):
+        if self._writer:
+            try:
+                self._writer.close()
+            except Exception:
+                pass
+            self._reader = None
+            self._writer = None
+
+    async def request(self, method, path, body=None):
+        """
+        Send a request on the kept-alive connection.
+
+        Args:
+            method: HTTP method (e.g., "POST")
+            path: Request path including query string
+            body: Optional JSON request body (str or bytes-like, e.g. a memoryview)
+
+        Returns:
+            _Response with status_code, text and json()
+        """
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        for attempt in range(2):
+            fresh = self._writer is None
+            if fresh:
+                await self._connect()
+            try:
+                status, content, keep_alive = await asyncio.wait_for(
+                    self._exchange(method, path, body), self.timeout)
+            except (OSError, EOFError, ValueError, IndexError, asyncio.TimeoutError):
+                self.close()
+                if fresh or attempt:
+                    raise
+                continue  # stale keep-alive connection, reconnect once
+            if not fresh:
+                self.reused += 1
+            if not keep_alive:
+                self.close()
+            return _Response(status, content)
+
+    async def _exchange(self, method, path, body):
+        head = "%s %s HTTP/1.1\r\nHost: %s\r\nConnection: keep-alive\r\n" % (method, path, self.host)
+        if body is not None:
+            head += "Content-Type: application/json\r\nContent-Length: %d\r\n" % len(body)
+        self._writer.write(head.encode() + b"\r\n")
+        if body is not None and len(body):
+            self._writer.write(body)
+        await self._writer.drain()
+        return await self._read_response()
+
+    async def _read_response(self):
+        reader = self._reader
+        line = await reader.readline()
+        if not line:
+            raise OSError("connection closed")
+        status = int(line.split(None, 2)[1])
+        length = None
+        chunked = False
+        keep_alive = True
+        while True:
+            line = await reader.readline()
+            if not line or line == b"\r\n":
+                break
+            name, value = line.split(b":", 1)
+            name = name.strip().lower()
+            value = value.strip().lower()
+            if name == b"content-length":
+                length = int(value)
+            elif name == b"transfer-encoding":
+                chunked = b"chunked" in value
+            elif name == b"connection":
+                keep_alive = value != b"close"
+        if chunked:
+            content = bytearray()
+            while True:
+                size = int((await reader.readline()).split(b";", 1)[0].strip(), 16)
+                if size == 0:
+                    while (await reader.readline()) not in (b"\r\n", b""):
+                        pass  # skip trailers
+                    break
+                content += await reader.readexactly(size)
+                await reader.readexactly(2)  # CRLF after each chunk
+        elif length is not None:
+            content = await reader.readexactly(length)
+        else:
+            # No framing: body runs until the server closes the connection
+            content = await reader.read(-1)
+            keep_alive = False
+        return status, bytes(content), keep_alive
+
 
 class FirebaseSync:
-    def __init__(self, project_id, api_key):
+    def __init__(self, project_id, api_key, device_id="pico", body_size=8192):
         """
         Initialize Firestore sync handler.
         
         Args:
             project_id: Your Firebase project ID (e.g., "climate-app-9baca")
             api_key: Your Firebase API key
+            device_id: Name of this device in document IDs (several devices can
+                share the collections)
+            body_size: Bytes of the reusable request body buffer
         """
         self.project_id = project_id
         self.api_key = api_key
-        self.base_url = f"https://firestore.googleapis.com/v1/projects/{project_id}/databases/(default)/documents"
+        self.device_id = device_id
+        self.base_path = f"/v1/projects/{project_id}/databases/(default)/documents"
+        self.doc_prefix = f"projects/{project_id}/databases/(default)/documents"
+        self.session = HttpsSession(FIRESTORE_HOST)
+        self.body = TextBuffer(body_size)  # every request body is serialized here
+        self.failures = 0  # requests that failed or were rejected
+    
+    def connection_stats(self):
+        """Return counters for TLS handshakes versus requests on a reused connection"""
+        return {"handshakes": self.session.handshakes, "reused": self.session.reused}
     
-    def send_data(self, collection, data):
+    async def send_data(self, collection, values, schema=READING_SCHEMA):
         """
         Send data to Firestore.
         
         Args:
             collection: Collection name (e.g., "air_quality_readings")
-            data: Dictionary containing the data to send
+            values: Record (tuple or dict) laid out as the schema expects
+            schema: DocumentSchema of the document
             
         Returns:
             True if successful, False otherwise
         """
         try:
             # Construct Firestore URL
-            url = f"{self.base_url}/{collection}?key={self.api_key}"
+            url = f"{self.base_path}/{collection}?key={self.api_key}"
             
-            # Convert data to Firestore format
-            firestore_data = {
-                "fields": {
-                    "timestamp": {"stringValue": data.get("timestamp", "")},
-                    "temperature_C": {"doubleValue": data.get("temperature_C", 0)},
-                    "humidity_percent": {"doubleValue": data.get("humidity_%", 0)},
-                    "pressure_hPa": {"doubleValue": data.get("pressure_hPa", 0)},
-                    "gas_ohms": {"integerValue": str(data.get("gas_ohms", 0))}
-                }
-            }
-            
-            json_data = ujson.dumps(firestore_data)
+            body = _check(schema.document_into(self.body.clear(), values))
             
             # Send POST request to Firestore
-            response = urequests.post(
-                url,
-                data=json_data,
-                headers={"Content-Type": "application/json"}
-            )
+            response = await self.session.request("POST", url, body.view())
             
             # Check if request was successful
             if response.status_code in [200, 201]:
@@ -60,45 +413,191 @@ class FirebaseSync:
             else:
                 print(f"Firestore sync failed: {response.status_code} - {response.text}")
                 response.close()
+                self.failures += 1
                 return False
                 
         except Exception as e:
             print(f"Firestore sync error: {e}")
+            self.failures += 1
             return False
     
-    def update_data(self, collection, document_id, data):
+    def _write_head(self, body, prefix, doc_id):
+        body.text(b'{"update":{"name":"').text(prefix).text(doc_id.encode()).text(b'","fields":')
+    
+    async def _send_writes(self, body, count, label):
+        """
+        Post a batchWrite body holding `count` writes.
+        
+        Returns:
+            List of booleans, one per write (all False if the request failed)
+        """
+        response = await self.session.request("POST", f"{self.base_path}:batchWrite?key={self.api_key}", body.view())
+        if response.status_code == 200:
+            # batchWrite is not atomic: one status per write, code 0 means OK
+            statuses = response.json().get("status", [])
+            response.close()
+            return [i < len(statuses) and statuses[i].get("code", 0) == 0 for i in range(count)]
+        print(f"Firestore {label} failed: {response.status_code} - {response.text}")
+        response.close()
+        self.failures += 1
+        return [False] * count
+    
+    async def send_batch(self, collection, records, doc_ids=None, schema=READING_SCHEMA):
+        """
+        Send many documents to Firestore in a single batchWrite request.
+        
+        Args:
+            collection: Collection name (e.g., "air_quality_readings")
+            records: List of records (tuples or dicts) laid out as the schema expects
+            doc_ids: Optional list of document IDs, one per record. Reusing the
+                same ID on retry overwrites instead of duplicating. Random IDs
+                are generated when omitted.
+            schema: DocumentSchema of the documents
+            
+        Returns:
+            List of booleans, True where that write succeeded (all False if the
+            request itself failed). Records that did not fit in the body buffer
+            are not sent, so the list can be shorter than records.
+        """
+        if not records:
+            return []
+        try:
+            prefix = f"{self.doc_prefix}/{collection}/".encode()
+            body = self.body.clear().text(b'{"writes":[')
+            count = 0
+            for i in range(len(records)):
+                mark = body.n
+                if count:
+                    body.text(b",")
+                self._write_head(body, prefix, doc_ids[i] if doc_ids else _new_doc_id())
+                schema.fields_into(body, records[i]).text(b"}}")
+                if body.n + 2 >= body.size:
+                    body.n = mark  # no room for this write and the closing "]}"
+                    break
+                count += 1
+            _check(body.text(b"]}"))
+            if not count:
+                raise ValueError("document larger than the request body buffer")
+            
+            results = await self._send_writes(body, count, "batch")
+            print(f"Firestore batch: {results.count(True)}/{count} written")
+            return results
+                
+        except Exception as e:
+            print(f"Firestore batch error: {e}")
+            self.failures += 1
+            return [False] * len(records)
+    
+    def hour_doc_id(self, ts):
+        """
+        ID of the hour document holding a reading: <device>_YYYYMMDDTHH+OO in
+        local time and its UTC offset, so the hour repeated when DST ends gets
+        a document of its own
+        """
+        offset = utc_offset_hours(time.gmtime(ts))
+        t = time.gmtime(ts + offset * 3600)
+        return "{}_{:04d}{:02d}{:02d}T{:02d}+{:02d}".format(
+            self.device_id, t[0], t[1], t[2], t[3], offset)
+    
+    def record_doc_id(self, ts):
+        """Stable ID of the document of one reading or bucket: <device>_YYYYMMDDTHHMMSS+OO (as hour_doc_id)"""
+        offset = utc_offset_hours(time.gmtime(ts))
+        t = time.gmtime(ts + offset * 3600)
+        return "{}_{:04d}{:02d}{:02d}T{:02d}{:02d}{:02d}+{:02d}".format(
+            self.device_id, t[0], t[1], t[2], t[3], t[4], t[5], offset)
+    
+    async def send_hourly(self, collection, records, schema=HOURLY_SCHEMA):
+        """
+        Append readings to one document per device per hour, in a single batchWrite.
+        
+        Each hour document holds the hour start, the column names and a map "r"
+        from second-of-hour to the row of schema values. Every write only names
+        the new rows in its updateMask, so existing rows are kept, the document
+        is created by its first write, and re-sending a reading after a failure
+        overwrites its own row instead of adding a duplicate.
+        
+        Args:
+            collection: Collection name (e.g., "air_quality_hourly")
+            records: List of sensor log records, oldest first
+            schema: DocumentSchema of one row
+            
+        Returns:
+            List of booleans, one per record, as send_batch (shorter than records
+            if the later hours did not fit in the body buffer)
+        """
+        if not records:
+            return []
+        try:
+            prefix = f"{self.doc_prefix}/{collection}/".encode()
+            body = self.body.clear().text(b'{"writes":[')
+            doc_ids = [self.hour_doc_id(r[0]) for r in records]
+            docs = []      # doc IDs written, in write order
+            for doc_id in doc_ids:
+                if doc_id in docs:
+                    continue
+                mark = body.n
+                if docs:
+                    body.text(b",")
+                self._write_head(body, prefix, doc_id)
+                rows = [i for i in range(len(records)) if doc_ids[i] == doc_id]
+                ts = records[rows[0]][0]
+                body.text(b'{"device":').text(b'{"stringValue":"').text(self.device_id.encode())
+                body.text(b'"},"hour":{"stringValue":"')
+                _timestamp_into(body, ts - ts % 3600)  # UTC and local hours start together
+                body.text(b'"},"columns":').text(schema.columns).text(b',"r":{"mapValue":{"fields":{')
+                for n, i in enumerate(rows):
+                    body.text(b',"' if n else b'"').integer(records[i][0] % 3600).text(b'":')  # second of the hour
+                    schema.row_into(body, records[i])
+                body.text(b'}}}}},"updateMask":{"fieldPaths":["device","hour","columns"')
+                for i in rows:
+                    body.text(b',"r.`').integer(records[i][0] % 3600).text(b'`"')
+                body.text(b"]}}")
+                if body.n + 2 >= body.size:
+                    body.n = mark  # no room for this hour and the closing "]}"
+                    break
+                docs.append(doc_id)
+            _check(body.text(b"]}"))
+            if not docs:
+                raise ValueError("hour document larger than the request body buffer")
+            
+            ok = await self._send_writes(body, len(docs), "hourly")
+            # Leading records whose hour was written; stop at the first one left out
+            results = []
+            for doc_id in doc_ids:
+                if doc_id not in docs:
+                    break
+                results.append(ok[docs.index(doc_id)])
+            print(f"Firestore hourly: {results.count(True)}/{len(results)} written to {len(docs)} documents")
+            return results
+                
+        except Exception as e:
+            print(f"Firestore hourly error: {e}")
+            self.failures += 1
+            return [False] * len(records)
+    
+    async def update_data(self, collection, document_id, values, schema=READING_SCHEMA, select=None):
         """
         Update existing data in Firestore.
         
         Args:
             collection: Collection name
             document_id: Document ID to update
-            data: Dictionary containing the data to update
+            values: Record (tuple or dict) laid out as the schema expects
+            schema: DocumentSchema of the document
+            select: Only write these field positions (updateMask) and keep the
+                other fields of the document; creates the document if it is missing
             
         Returns:
             True if successful, False otherwise
         """
         try:
-            url = f"{self.base_url}/{collection}/{document_id}?key={self.api_key}"
-            
-            # Convert data to Firestore format
-            firestore_data = {
-                "fields": {
-                    "timestamp": {"stringValue": data.get("timestamp", "")},
-                    "temperature_C": {"doubleValue": data.get("temperature_C", 0)},
-                    "humidity_percent": {"doubleValue": data.get("humidity_%", 0)},
-                    "pressure_hPa": {"doubleValue": data.get("pressure_hPa", 0)},
-                    "gas_ohms": {"integerValue": str(data.get("gas_ohms", 0))}
-                }
-            }
+            url = f"{self.base_path}/{collection}/{document_id}?key={self.api_key}"
+            if select is not None:
+                url += schema.mask(select)
             
-            json_data = ujson.dumps(firestore_data)
+            body = _check(schema.document_into(self.body.clear(), values, select))
             
-            response = urequests.patch(
-                url,
-                data=json_data,
-                headers={"Content-Type": "application/json"}
-            )
+            response = await self.session.request("PATCH", url, body.view())
             
             if response.status_code == 200:
                 print(f"Firestore update successful")
@@ -107,13 +606,134 @@ class FirebaseSync:
             else:
                 print(f"Firestore update failed: {response.status_code}")
                 response.close()
+                self.failures += 1
                 return False
                 
         except Exception as e:
             print(f"Firestore update error: {e}")
+            self.failures += 1
             return False
 
 
+class LatestDocument:
+    def __init__(self, collection, document_id, schema=LATEST_SCHEMA):
+        """
+        One well-known document holding the device's current values, so readers
+        fetch a single document instead of querying a collection.
+
+        Args:
+            collection: Collection name (e.g., "devices")
+            document_id: Document ID (e.g., the device ID)
+            schema: DocumentSchema of the document (values come from a dict)
+        """
+        self.collection = collection
+        self.document_id = document_id
+        self.schema = schema
+        self.writes = 0
+        self._sent = [None] * len(schema.names)  # values confirmed by Firestore
+
+    async def publish(self, firebase, values):
+        """
+        Patch the fields that changed (after rounding) since the last successful write.
+
+        Args:
+            firebase: FirebaseSync
+            values: Dict keyed by the schema sources; missing keys are left as they are
+
+        Returns:
+            True if the document is up to date, False if the write failed
+        """
+        schema = self.schema
+        sent = self._sent
+        changed = [i for i in range(len(sent))
+                   if schema.sources[i] in values and schema.value(values, i) != sent[i]]
+        if not changed:
+            return True
+        if not await firebase.update_data(self.collection, self.document_id, values, schema, changed):
+            return False
+        for i in changed:
+            sent[i] = schema.value(values, i)
+        self.writes += 1
+        return True
+
+
+class UploadOutbox:
+    def __init__(self, path="outbox.log", capacity=2048, fmt=RECORD_FMT,
+                 schema=None, doc_id=None, hourly=False):
+        """
+        Persistent FIFO of readings waiting for upload to Firestore.
+
+        Args:
+            path: Outbox file on flash
+            capacity: Maximum queued readings; the oldest are dropped when full
+            fmt: struct format of a queued record (default: sensor log record)
+            schema: DocumentSchema of the uploaded documents, or of the rows if
+                hourly (default: READING_SCHEMA, or HOURLY_SCHEMA if hourly)
+            doc_id: Function returning the document ID of a record tuple
+                (default: FirebaseSync.record_doc_id of its timestamp)
+            hourly: Append to hour documents (FirebaseSync.send_hourly) instead
+                of writing one document per record
+        """
+        self._log = RingLog(path, fmt=fmt, capacity=capacity)
+        if schema is None:
+            schema = HOURLY_SCHEMA if hourly else READING_SCHEMA
+        self._schema = schema
+        self._doc_id = doc_id
+        self._hourly = hourly
+
+    def __len__(self):
+        return len(self._log)
+
+    @property
+    def bytes_written(self):
+        return self._log.bytes_written
+
+    def enqueue(self, ts, temp, hum, pres, gas, iaq_code):
+        """Queue one reading (one fixed-size record written to flash)"""
+        self._log.append(ts, temp, hum, pres, gas, iaq_code)
+
+    def enqueue_packed(self, record):
+        """Queue one reading already packed as a sensor log record"""
+        self._log.append_packed(record)
+
+    async def drain(self, firebase, collection, budget_ms=2000, batch_size=20):
+        """
+        Upload queued readings oldest first, up to batch_size readings per request.
+
+        A reading is removed only after Firestore confirms it. Document IDs are
+        derived from the reading timestamp, so re-sending after a partial failure
+        overwrites rather than duplicates. Stops on a failed write, when the
+        outbox is empty, or once budget_ms has been spent.
+
+        Returns:
+            Number of readings uploaded
+        """
+        start = time.ticks_ms()
+        sent = 0
+        log = self._log
+        while len(log) and time.ticks_diff(time.ticks_ms(), start) < budget_ms:
+            count = min(batch_size, len(log))
+            records = [log.read(seq) for seq in range(log.tail, log.tail + count)]
+            if self._hourly:
+                results = await firebase.send_hourly(collection, records, self._schema)
+            else:
+                if self._doc_id:
+                    doc_ids = [self._doc_id(record) for record in records]
+                else:
+                    doc_ids = [firebase.record_doc_id(record[0]) for record in records]
+                results = await firebase.send_batch(collection, records, doc_ids, self._schema)
+            records = None
+            # Only the leading run of confirmed writes can leave the FIFO
+            ok = 0
+            while ok < len(results) and results[ok]:
+                ok += 1
+            log.discard(ok)
+            sent += ok
+            if not ok or ok < len(results):
+                break
+        return sent
+
+
 def load_firebase_config():
     """Load Firebase configuration from firebase_config.json"""
     try:
@@ -0,0 +1,105 @@
+# history.py
+# Recent readings in RAM as a columnar ring buffer: one typed array per field
+# (21 bytes per reading instead of a dict per reading), O(1) append, and
+# min/max/mean over a time window without creating per-reading objects
+
+from array import array
+
+FIELDS = ("temp", "hum", "pres", "gas")
+
+
+class History:
+    def __init__(self, capacity=2048):
+        """
+        Args:
+            capacity: Readings kept; the oldest is overwritten when full
+        """
+        self.capacity = capacity
+        self.ts = array("L", [0] * capacity)    # UTC epoch seconds
+        self.temp = array("f", [0] * capacity)  # C
+        self.hum = array("f", [0] * capacity)   # %
+        self.pres = array("f", [0] * capacity)  # hPa
+        self.gas = array("L", [0] * capacity)   # ohms
+        self.iaq = bytearray(capacity)          # index into IAQ_LABELS
+        self.head = 0    # slot of the next append
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, ts, temp, hum, pres, gas, iaq):
+        i = self.head
+        self.ts[i] = ts
+        self.temp[i] = temp
+        self.hum[i] = hum
+        self.pres[i] = pres
+        self.gas[i] = gas
+        self.iaq[i] = iaq
+        self.head = (i + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    def _slot(self, n):
+        """Slot of the n-th oldest reading"""
+        return (self.head - self.count + n) % self.capacity
+
+    def get(self, n):
+        """The n-th oldest reading as (ts, temp, hum, pres, gas, iaq); negative n counts from the newest"""
+        if n < 0:
+            n += self.count
+        if not 0 <= n < self.count:
+            raise IndexError("history index out of range")
+        i = self._slot(n)
+        return self.ts[i], self.temp[i], self.hum[i], self.pres[i], self.gas[i], self.iaq[i]
+
+    def find(self, ts):
+        """Position (0 = oldest) of the first reading at or after epoch `ts` (binary search)"""
+        lo = 0
+        hi = self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.ts[self._slot(mid)] < ts:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def oldest(self):
+        """Epoch of the oldest reading held, or None when empty"""
+        return self.ts[self._slot(0)] if self.count else None
+
+    def stats(self, field, since=None, until=None):
+        """
+        Summary of one field over a time window.
+
+        Args:
+            field: One of FIELDS
+            since: First epoch included (default: oldest reading)
+            until: Last epoch included (default: newest reading)
+
+        Returns:
+            (min, max, mean, count), or None if no reading falls in the window
+        """
+        column = getattr(self, field)
+        ts = self.ts
+        n = self.find(since) if since is not None else 0
+        lo = hi = total = None
+        count = 0
+        while n < self.count:
+            i = self._slot(n)
+            if until is not None and ts[i] > until:
+                break
+            v = column[i]
+            if count:
+                if v < lo:
+                    lo = v
+                elif v > hi:
+                    hi = v
+                total += v
+            else:
+                lo = hi = total = v
+            count += 1
+            n += 1
+        if not count:
+            return None
+        return lo, hi, total / count, count
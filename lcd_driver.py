@@ -3,9 +3,24 @@ import time
 from machine import I2C
 
 LCD_ADDR = 0x3E
+LCD_WIDTH = 16
+LCD_LINES = 2
+
+# Shadow framebuffer: what is currently on screen, one bytearray per line
+_shadow = [bytearray(b' ' * LCD_WIDTH) for _ in range(LCD_LINES)]
+# Preallocated I2C buffers: control byte followed by a data burst / command
+_data_buf = bytearray(1 + LCD_WIDTH)
+_data_buf[0] = 0x40
+_data_mv = memoryview(_data_buf)
+_line_buf = bytearray(LCD_WIDTH)
+_cmd_buf = bytearray(b'\x80\x00')
+# Unchanged characters between two changed runs are resent if the gap is at
+# most this long, since that is cheaper than another cursor command
+_MAX_GAP = 2
 
 def lcd_cmd(i2c, cmd):
-    i2c.writeto(LCD_ADDR, b'\x80' + bytes([cmd]))
+    _cmd_buf[1] = cmd
+    i2c.writeto(LCD_ADDR, _cmd_buf)
 
 def lcd_data(i2c, ch):
     i2c.writeto(LCD_ADDR, b'\x40' + bytes([ord(ch)]))
@@ -18,25 +33,61 @@ def pad_right(text, width=16):
         s = s + (' ' * (width - len(s)))
     return s
 
-def lcd_print(i2c, text, width=16):
-    s = pad_right(text, width)
-    for ch in s:
-        b = ord(ch)
+def _to_lcd(text, out, width=16):
+    """Pad/truncate text (str or bytes-like) into out[0:width] as printable ASCII,
+    '?' for anything else"""
+    if not isinstance(text, (bytes, bytearray, memoryview)):
+        text = str(text)
+    n = 0
+    for ch in text:
+        if n == width:
+            break
+        b = ch if isinstance(ch, int) else ord(ch)
         if b < 32 or b > 126:
-            b = ord('?')
-        i2c.writeto(LCD_ADDR, b'\x40' + bytes([b]))
+            b = 63  # '?'
+        out[n] = b
+        n += 1
+    while n < width:
+        out[n] = 32
+        n += 1
+
+def lcd_print(i2c, text, width=16):
+    _to_lcd(text, _line_buf, width)
+    _data_buf[1:1 + width] = _line_buf[:width]
+    i2c.writeto(LCD_ADDR, _data_mv[:1 + width])
 
 def lcd_write_line(i2c, line, text):
+    """Update one line, sending only the runs of characters that changed"""
     addr = 0x80 if line == 0 else 0xC0
-    lcd_cmd(i2c, addr)
-    lcd_print(i2c, text)
+    shadow = _shadow[line]
+    new = _line_buf
+    _to_lcd(text, new, LCD_WIDTH)
+    i = 0
+    while i < LCD_WIDTH:
+        if new[i] == shadow[i]:
+            i += 1
+            continue
+        # Extend the run while changes continue or the unchanged gap is short
+        start = i
+        end = i + 1
+        j = end
+        while j < LCD_WIDTH and j - end < _MAX_GAP:
+            if new[j] != shadow[j]:
+                end = j + 1
+            j += 1
+        n = end - start
+        for k in range(n):  # byte copies; slicing would allocate
+            _data_buf[1 + k] = new[start + k]
+        lcd_cmd(i2c, addr + start)
+        i2c.writeto(LCD_ADDR, _data_mv[:1 + n])
+        for k in range(start, end):
+            shadow[k] = new[k]
+        i = end
 
 def lcd_init(i2c):
     lcd_cmd(i2c, 0x38)  # Function set
     lcd_cmd(i2c, 0x0C)  # Display ON
     lcd_cmd(i2c, 0x01)  # Clear
     time.sleep_ms(2)
-
-
-
-
+    for line in _shadow:
+        line[:] = b' ' * LCD_WIDTH
@@ -1,68 +1,42 @@
 # main.py
 # Pico W: LCD dashboard + non-blocking Wi‑Fi + LED status + DST local time (FI) +
 # hourly NTP sync + web server with / (HTML) and /data (JSON) + sensor logging
-# Firebase sync every minute
+# Per-minute / per-hour rollups on flash, synced to Firestore via on-flash outboxes
+# Runs as cooperative uasyncio tasks, each with its own period; optionally the
+# sensor and LCD run on the second core (DUAL_CORE)
+# Per-stage timings and counters at /metrics (Prometheus text format)
 
-from machine import I2C, Pin, RTC, ADC
-import time, ujson, network, ntptime, socket
+from machine import I2C, Pin, RTC, ADC, lightsleep, unique_id
+import time, ujson, network, ntptime, ubinascii, struct
+from array import array
+import uasyncio as asyncio
 import lcd_driver
 from bme680 import *
-from firebase_sync import FirebaseSync, load_firebase_config
-
-# --- IAQ calculation ---
-def calculate_iaq(humidity, gas_res):
-    humidity_baseline = 40
-    humidity_weighting = 0.25
-    humidity_offset = humidity - humidity_baseline
-    if humidity_offset > 0:
-        humidity_score = (100 - humidity_baseline - humidity_offset) / \
-                         (100 - humidity_baseline) * (humidity_weighting * 100)
-    else:
-        humidity_score = (humidity_baseline + humidity_offset) / \
-                         humidity_baseline * (humidity_weighting * 100)
-    gas_score = min((gas_res / 100000.0), 1.0) * (100 - (humidity_weighting * 100))
-    iaq = humidity_score + gas_score
-    if iaq >= 80: return "Good"
-    elif iaq >= 60: return "Avg"
-    elif iaq >= 40: return "Poor"
-    else: return "Bad"
-
-# --- DST-aware localtime (Finland: EET/EEST) ---
-def is_leap(year):
-    return (year % 4 == 0 and year % 100 != 0) or (year % 400 == 0)
-
-def days_in_month(year, month):
-    if month == 2: return 29 if is_leap(year) else 28
-    return [31, None, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31][month-1]
-
-def weekday(y, m, d):
-    t = [0, 3, 2, 5, 0, 3, 5, 1, 4, 6, 2, 4]
-    if m < 3:
-        y -= 1
-    return (y + y//4 - y//100 + y//400 + t[m-1] + d) % 7
-
-def last_sunday(year, month):
-    ld = days_in_month(year, month)
-    wd = weekday(year, month, ld)
-    return ld if wd == 0 else ld - wd
-
-def localtime_with_dst():
-    utc = time.localtime()
-    year, month, day = utc[0], utc[1], utc[2]
-    dst_start_day = last_sunday(year, 3)
-    dst_end_day   = last_sunday(year, 10)
-    in_dst = (month > 3 and month < 10) or \
-             (month == 3 and day >= dst_start_day) or \
-             (month == 10 and day <= dst_end_day)
-    offset_hours = 3 if in_dst else 2
-    return time.localtime(time.time() + offset_hours * 3600)
+from firebase_sync import FirebaseSync, UploadOutbox, LatestDocument, bucket_schema, load_firebase_config
+from ring_log import RingLog, RECORD_FMT, IAQ_LABELS
+from reading import (Reading, update_reading, RecordQueue, SharedRecordQueue, SharedValues, RECORD_SIZE, lcd_time_line, lcd_air_line,
+                     lcd_humidity_line, lcd_average_line, json_into)
+from textbuf import TextBuffer
+from checkpoint import Checkpoint
+from scheduler import AdaptiveSchedule
+from history import History, FIELDS as HISTORY_FIELDS
+from rollup import Rollup, ROLLUP_FMT, FIELDS as ROLLUP_FIELDS
+from compress import Compressor
+from web_server import WebServer, EventStream
+import web_page
+from metrics import Metrics, CountingI2C
+
 time.sleep(4)
+# --- Instrumentation ---
+stats = Metrics()
+
 # --- Hardware setup ---
-i2c = I2C(0, sda=Pin(0), scl=Pin(1), freq=100000)
+i2c = CountingI2C(I2C(0, sda=Pin(0), scl=Pin(1), freq=100000), stats)
 lcd_driver.lcd_init(i2c)
 bme = BME680_I2C(i2c, address=0x77)
 rtc = RTC()
 led = Pin("LED", Pin.OUT)
+chip_adc = ADC(4)
 
 # --- Wi‑Fi setup ---
 wlan = network.WLAN(network.STA_IF)
@@ -84,266 +58,621 @@ def connect_wifi():
         print("Connecting Wi‑Fi…")
         wlan.connect(SSID, PASSWORD)
 
-# --- Restore RTC from last saved UTC time ---
-try:
-    with open("last_values.json", "r") as f:
-        last_data = ujson.load(f)
-        date_parts = [int(x) for x in last_data["date"].split("-")]
-        time_parts = [int(x) for x in last_data["time_sec"].split(":")]
-        rtc.datetime((date_parts[2], date_parts[1], date_parts[0],
-                      0, time_parts[0], time_parts[1], time_parts[2], 0))
-        print("Restored time:", rtc.datetime())
-except Exception:
+# --- Sensor log (append-only ring buffer on flash) ---
+sensor_log = RingLog("data.log")
+print("Sensor log:", len(sensor_log), "records")
+
+# --- Compression of the readings stored in data.log (and uploaded, if enabled) ---
+# "swinging_door" keeps segment end points (rebuild by linear interpolation),
+# "deadband" keeps readings that moved past the tolerance (rebuild by holding
+# the last value), None keeps every reading. Rollups and the RAM history always
+# see every reading.
+COMPRESSION = "swinging_door"
+COMPRESSION_TOLERANCE = {   # field: (absolute, relative) - the larger applies
+    "temp": (0.1, 0),       # C
+    "hum": (0.5, 0),        # %
+    "pres": (0.1, 0),       # hPa
+    "gas": (0, 0.02),       # 2 % of the resistance
+}
+COMPRESSION_MAX_GAP_S = 600 # Keep a reading at least every 10 min
+compressor = None
+if COMPRESSION:
+    compressor = Compressor(COMPRESSION_TOLERANCE, COMPRESSION, COMPRESSION_MAX_GAP_S)
+
+# --- Rollups: closed minute / hour buckets of the readings, on flash ---
+minutes = Rollup(60, "minutes.log", 1440)    # 24 h
+hours = Rollup(3600, "hours.log", 1440)      # 60 days
+
+def newest_logged():
+    """UTC time of the newest reading on flash: the last data.log record, or the
+    reading that closed the newest minute / hour bucket; 0 if all logs are empty"""
+    newest = 0
+    for log, period in ((sensor_log, 0), (minutes.log, 60), (hours.log, 3600)):
+        if len(log):
+            newest = max(newest, log.read(log.head - 1)[0] + period)
+    return newest
+
+# --- Restore RTC from the last state checkpoint ---
+CHECKPOINT_INTERVAL_S = 600  # state is written at most this often (plus NTP sync / reboot)
+state = Checkpoint("state", slots=3, interval_s=CHECKPOINT_INTERVAL_S)
+saved = state.load()
+if saved is None:
+    # No checkpoint yet: fall back to last_values.json from older firmware
+    try:
+        with open("last_values.json", "r") as f:
+            last_data = ujson.load(f)
+            date_parts = [int(x) for x in last_data["date"].split("-")]
+            time_parts = [int(x) for x in last_data["time_sec"].split(":")]
+            saved = {"utc": time.mktime((date_parts[2], date_parts[1], date_parts[0],
+                                         time_parts[0], time_parts[1], time_parts[2], 0, 0))}
+    except Exception:
+        saved = {}
+# Readings on flash are newer than the checkpoint when the device ran up to
+# CHECKPOINT_INTERVAL_S past it; never restart the clock behind them, so the
+# logs stay in time order (RingLog.find, /history and the rollups rely on it)
+newest = newest_logged()
+if newest:
+    saved["utc"] = max(saved.get("utc", 0), newest)
+if "utc" in saved:
+    t = time.localtime(saved["utc"])
+    rtc.datetime((t[0], t[1], t[2], 0, t[3], t[4], t[5], 0))
+    print("Restored time:", rtc.datetime())
+else:
     print("No saved time, RTC starts at default")
     
 connect_wifi()
 
 # --- Firestore setup ---
+# Minute and hour buckets are uploaded, and the readings kept by the compressor:
+# "hourly" appends them to one document per device per hour, "documents" writes
+# one document per reading, None does not upload them
+UPLOAD_READINGS = "hourly"
+DEVICE_ID = ubinascii.hexlify(unique_id()).decode()  # prefixes this device's document IDs
 project_id, api_key = load_firebase_config()
 firebase = None
+outbox = None
+latest = None           # devices/<DEVICE_ID>: current reading and 24 h min/max
+uploads = []            # (UploadOutbox, collection), drained in this order
 if project_id and api_key:
-    firebase = FirebaseSync(project_id, api_key)
-    print("Firestore configured:", project_id)
+    firebase = FirebaseSync(project_id, api_key, DEVICE_ID)
+    if UPLOAD_READINGS == "hourly":
+        outbox = UploadOutbox("outbox.log", hourly=True)
+        uploads.append((outbox, "air_quality_hourly"))
+    elif UPLOAD_READINGS:
+        outbox = UploadOutbox("outbox.log")
+        uploads.append((outbox, "air_quality_readings"))
+    minute_outbox = UploadOutbox("outbox_min.log", 1440, ROLLUP_FMT, bucket_schema(60, DEVICE_ID))
+    hour_outbox = UploadOutbox("outbox_hour.log", 720, ROLLUP_FMT, bucket_schema(3600, DEVICE_ID))
+    minutes.on_close = minute_outbox.enqueue_packed
+    hours.on_close = hour_outbox.enqueue_packed
+    latest = LatestDocument("devices", DEVICE_ID)
+    uploads.append((hour_outbox, "air_quality_hours"))
+    uploads.append((minute_outbox, "air_quality_minutes"))
+    print("Upload outbox:", sum(len(o) for o, _ in uploads), "queued")
+    print("Firestore configured:", project_id, "device", DEVICE_ID)
 else:
     print("Firestore not configured - skipping sync")
 
-# --- State ---
-modes = ["AIRTEMP", "HUMPRESS"]
-idx = 0
+# --- State (allocated once; the sampling path updates it in place) ---
+modes = ["AIRTEMP", "HUMPRESS", "AVERAGE"]
 start_time = time.time()
-last_wifi_attempt = 0
-last_ntp_sync = 0
-last_firebase_sync = 0  # Track last Firebase sync time
+reading = Reading()     # Latest reading; reading.seq is the ETag of /data
+system = {"utc": None, "uptime": 0, "chip_temp": 0.0, "wifi": False}  # System info (UTC epoch, formatted when used)
+pending = RecordQueue() # Packed readings waiting for the persistence task
+lcd_lines = (TextBuffer(lcd_driver.LCD_WIDTH), TextBuffer(lcd_driver.LCD_WIDTH))
+json_buf = TextBuffer(256)
+HISTORY_SIZE = 2048     # Recent readings kept in RAM for window statistics (~42 KB)
+history = History(HISTORY_SIZE)
 
-# --- Web server setup (non-blocking accept)
+# --- Task periods ---
+SAMPLE_MIN_MS = 2000      # Sensor reading interval while gas/humidity change quickly,
+SAMPLE_PERIOD_MS = 6000   # at start-up,
+SAMPLE_MAX_MS = 60000     # and after readings have been stable for a while
+LOW_POWER = False         # Spend long idle waits in machine.lightsleep (web server pauses meanwhile; single core only)
+LIGHTSLEEP_MIN_MS = 2000  # Shortest wait worth a lightsleep
+DUAL_CORE = False         # Sensor and LCD on core1 (blocking I/O), networking and flash on core0
+RECEIVE_PERIOD_MS = 200   # Dual-core: how often core0 takes new readings from core1
+LCD_PERIOD_MS = 6000      # LCD refresh / mode rotation
+PERSIST_PERIOD_MS = 6000  # Sensor log and outbox writes, state checkpoint when due
+WIFI_PERIOD_MS = 1000     # LED status; reconnect every 60s, NTP every hour
+UPLOAD_PERIOD_MS = 5000   # Outbox drain; 60s back-off after a failure
+UPLOAD_BUDGET_MS = 2000   # Max time per pass spent draining the outbox
+LATEST_PERIOD_MS = 60000  # Firestore latest-values document update
+LATEST_WINDOW_S = 86400   # Min/max window of the latest-values document
 PORT = 80
-try:
-    s
-    try:
-        s.close()
-    except Exception:
-        pass
-except NameError:
-    pass
-addr = socket.getaddrinfo('0.0.0.0', PORT)[0][-1]
-s = socket.socket()
-s.bind(addr)
-s.listen(2)
-s.settimeout(0.5)
-print("Web server ready")
-print("Server bound to", addr)
-print("Open in browser:", "http://{}".format(wlan.ifconfig()[0]))
-
-led_state = 0
-while True:
-    # LED indicator
-    if led_state == 0 and wlan.isconnected():
-        led.value(1)
-        led_state = 1
-        print(wlan.ifconfig())
-        print("Web server ready")
-        print("Server bound to", addr)
-        print("Open in browser:", "http://{}".format(wlan.ifconfig()[0]))
-    elif led_state == 1 and not wlan.isconnected():
-        led.value(0)
-        led_state = 0
-    # Measurements
-    utc = time.localtime()
-    local = localtime_with_dst()
-    temp = bme.temperature
-    hum  = bme.humidity
-    pres = bme.pressure
-    gas  = bme.gas
-    iaq  = calculate_iaq(hum, gas)
-    uptime = int(time.time() - start_time)
-
-    # Internal chip temperature
-    sensor_temp = ADC(4)
+
+def read_chip_temp():
     conversion_factor = 3.3 / 65535
-    reading = sensor_temp.read_u16() * conversion_factor
-    internal_temp = 27 - (reading - 0.706)/0.001721
+    voltage = chip_adc.read_u16() * conversion_factor
+    return 27 - (voltage - 0.706)/0.001721
 
-    # Append sensor log (local time)
-    try:
-        with open("data.json", "r") as f:
-            sensor_log = ujson.load(f)
-            if not isinstance(sensor_log, list):
-                sensor_log = []
-    except Exception:
-        sensor_log = []
-    sensor_log.append({
-        "time": "{:02d}:{:02d}:{:02d}".format(local[3], local[4], local[5]),
-        "date": "{:02d}-{:02d}-{:04d}".format(local[2], local[1], local[0]),
-        "temp": round(temp, 2),
-        "hum": round(hum, 2),
-        "pres": round(pres, 0),
-        "iaq": iaq
-    })
-    if len(sensor_log) > 500:
-        sensor_log = sensor_log[-500:]
-    with open("data.json", "w") as f:
-        ujson.dump(sensor_log, f)
-
-    # Save latest reading to pending_upload.json for Firebase sync
-    pending_data = {
-        "timestamp": "{:04d}-{:02d}-{:02d}T{:02d}:{:02d}:{:02d}".format(
-            local[0], local[1], local[2], local[3], local[4], local[5]
-        ),
-        "temperature_C": round(temp, 2),
-        "humidity_%": round(hum, 2),
-        "pressure_hPa": round(pres, 1),
-        "gas_ohms": int(gas)
-    }
-    try:
-        with open("pending_upload.json", "w") as f:
-            ujson.dump(pending_data, f)
-    except Exception as e:
-        print(f"Error saving pending upload: {e}")
-
-    # Save system info (UTC) for last_values.json
-    sys_data = {
-        "time": "{:02d}:{:02d}".format(utc[3], utc[4]),
-        "time_sec": "{:02d}:{:02d}:{:02d}".format(utc[3], utc[4], utc[5]),
-        "date": "{:02d}-{:02d}-{:04d}".format(utc[2], utc[1], utc[0]),
-        "uptime_sec": uptime,
-        "wifi": "OK" if wlan.isconnected() else "OFF",
-        "chip_temp": round(internal_temp, 2),
-        "chip": "RP2040"
-    }
-    with open("last_values.json", "w") as f:
-        ujson.dump(sys_data, f)
-
-    # LCD update (local time)
-    line_1 = "{:02d}:{:02d} {:02d}-{:02d}-{:04d}".format(local[3], local[4], local[2], local[1], local[0])
+# --- Sampler: one BME680 measurement per deadline of the adaptive schedule ---
+async def measure():
+    """Trigger a BME680 measurement and yield to other tasks while it converts"""
+    ready_at = bme.start_measurement()
+    while True:
+        await asyncio.sleep_ms(max(0, time.ticks_diff(ready_at, time.ticks_ms())))
+        snapshot = bme.collect()
+        if snapshot:
+            return snapshot
+        ready_at = time.ticks_add(time.ticks_ms(), 5)
+
+schedule = AdaptiveSchedule(SAMPLE_MIN_MS, SAMPLE_PERIOD_MS, SAMPLE_MAX_MS)
+
+def idle():
+    """True if nothing is waiting to be written, sent or served"""
+    return (not len(pending) and not web.clients and not events.subscribers
+            and (not upload_queued() or not wlan.isconnected()))
+
+async def wait_ms(delay):
+    """Wait for the next sample; in LOW_POWER mode idle stretches are spent in lightsleep"""
+    end = time.ticks_add(time.ticks_ms(), delay)
+    while True:
+        remaining = time.ticks_diff(end, time.ticks_ms())
+        if remaining <= 0:
+            return
+        if LOW_POWER and remaining >= LIGHTSLEEP_MIN_MS and idle():
+            lightsleep(remaining)
+        else:
+            # Short steps so the other tasks get a chance to finish before sleeping
+            await asyncio.sleep_ms(min(remaining, 1000) if LOW_POWER else remaining)
+
+def sample_taken(now):
+    """Core0 bookkeeping for a new `reading`: persistence queue, system info, live clients"""
+    pending.push(reading.record)
+    history.append(reading.ts, reading.temp, reading.hum, reading.pres, reading.gas, reading.iaq)
+    # System info (UTC) for the web page; formatted when used
+    system["utc"] = now
+    system["uptime"] = now - start_time
+    system["chip_temp"] = read_chip_temp()
+    system["wifi"] = wlan.isconnected()
+    if events.subscribers:
+        events.publish(data_json())
+    stats.sample_memory()
+
+async def sampler_task():
+    while True:
+        now = time.time()
+        t = stats.start()
+        snapshot = await measure()  # one measurement for all four values
+        stats.observe("sensor", t)
+        update_reading(reading, snapshot, now)
+        sample_taken(now)
+
+        # Faster while readings move, slower when stable; absolute deadlines so a
+        # late pass does not shift the following ones
+        schedule.observe(reading.gas, reading.hum)
+        await wait_ms(schedule.advance())
+
+# --- LCD: rotate between the two display modes (local time) ---
+averages = SharedValues(2)        # 1 h mean temperature and humidity, set on core0
+lcd_averages = array("f", [0, 0]) # the LCD's copy
+
+def refresh_averages():
+    """1 h averages for the LCD's AVERAGE mode, from the in-RAM history (core0 only)"""
+    temp = history.stats("temp", reading.ts - 3600)
+    hum = history.stats("hum", reading.ts - 3600)
+    if temp and hum:
+        averages.set(temp[2], hum[2])
+
+def draw_lcd(r, idx):
+    line_1 = lcd_time_line(lcd_lines[0], r.local)
     if modes[idx] == "AIRTEMP":
-        line_2 = "{:.2f} C {} Air".format(temp, iaq)
+        line_2 = lcd_air_line(lcd_lines[1], r)
+    elif modes[idx] == "HUMPRESS":
+        line_2 = lcd_humidity_line(lcd_lines[1], r)
     else:
-        line_2 = "{:.2f}% {:.0f} hPa".format(hum, pres)
-    lcd_driver.lcd_write_line(i2c, 0, line_1)
-    lcd_driver.lcd_write_line(i2c, 1, line_2)
-
-    # Wi‑Fi retry every 60s; hourly NTP sync; Firebase sync every 60s
-    if (time.time() - last_wifi_attempt) > 60:
-        if not wlan.isconnected():
-            connect_wifi()
+        # Averages computed on core0 by refresh_averages() (the history is only
+        # touched there; draw_lcd runs on core1 in dual-core mode)
+        if averages.get(lcd_averages):
+            line_2 = lcd_average_line(lcd_lines[1], lcd_averages[0], lcd_averages[1])
+        else:
+            line_2 = lcd_humidity_line(lcd_lines[1], r)
+    t = stats.start()
+    lcd_driver.lcd_write_line(i2c, 0, line_1.buf)
+    lcd_driver.lcd_write_line(i2c, 1, line_2.buf)
+    stats.observe("lcd", t)
+
+async def lcd_task():
+    idx = 0
+    while True:
+        if reading.seq:
+            if modes[idx] == "AVERAGE":
+                refresh_averages()
+            draw_lcd(reading, idx)
+            idx = (idx + 1) % len(modes)
+        await asyncio.sleep_ms(LCD_PERIOD_MS)
+
+# --- Dual-core mode: sensor and LCD on core1, readings handed over through a
+# locked ring, so TLS handshakes and HTTP on core0 do not delay sampling ---
+shared = SharedRecordQueue() if DUAL_CORE else None
+
+def measure_blocking():
+    ready_at = bme.start_measurement()
+    while True:
+        time.sleep_ms(max(0, time.ticks_diff(ready_at, time.ticks_ms())))
+        snapshot = bme.collect()
+        if snapshot:
+            return snapshot
+        ready_at = time.ticks_add(time.ticks_ms(), 5)
+
+def core1_main():
+    """Runs on core1 and owns the I2C bus: sampling on the adaptive schedule plus LCD refresh"""
+    r = Reading()  # core1's own copy; core0 rebuilds `reading` from the queued records
+    idx = 0
+    next_lcd = time.ticks_ms()
+    while True:
+        now = time.time()
+        t = stats.start()
+        snapshot = measure_blocking()
+        stats.observe("sensor", t)
+        update_reading(r, snapshot, now)
+        shared.push(r.record)
+        schedule.observe(r.gas, r.hum)
+        end = time.ticks_add(time.ticks_ms(), schedule.advance())
+        while True:
+            if time.ticks_diff(time.ticks_ms(), next_lcd) >= 0:
+                draw_lcd(r, idx)
+                idx = (idx + 1) % len(modes)
+                next_lcd = time.ticks_add(time.ticks_ms(), LCD_PERIOD_MS)
+            remaining = time.ticks_diff(end, time.ticks_ms())
+            if remaining <= 0:
+                break
+            time.sleep_ms(min(remaining, time.ticks_diff(next_lcd, time.ticks_ms())))
+
+async def receiver_task():
+    """Core0 side: take readings from core1 as they arrive"""
+    record = bytearray(RECORD_SIZE)
+    next_averages = time.ticks_ms()
+    while True:
+        while shared.take(record):
+            reading.load(record)
+            sample_taken(time.time())
+        # Core1's LCD shows averages of the history, which only core0 may read
+        if reading.seq and time.ticks_diff(time.ticks_ms(), next_averages) >= 0:
+            refresh_averages()
+            next_averages = time.ticks_add(time.ticks_ms(), LCD_PERIOD_MS)
+        await asyncio.sleep_ms(RECEIVE_PERIOD_MS)
+
+# --- Persistence: sensor log, rollups, upload outbox and state checkpoint ---
+def store_reading(record):
+    """Append a packed reading kept by the compressor to the sensor log (and the raw outbox)"""
+    try:
+        sensor_log.append_packed(record)
+    except Exception as e:
+        print(f"Error writing sensor log: {e}")
+    if outbox is not None:
+        try:
+            outbox.enqueue_packed(record)
+        except Exception as e:
+            print(f"Error queueing upload: {e}")
+
+def checkpoint_state(force=False):
+    """Copy the current state into the checkpoint; write it if due, or now if forced"""
+    if system["utc"] is None:
+        return
+    state.set("utc", time.time())
+    state.set("uptime_sec", system["uptime"])
+    try:
+        if force:
+            state.save(force=True)
         else:
-            if (time.time() - last_ntp_sync) > 3600:
+            state.maybe_save()
+    except Exception as e:
+        print(f"Error saving state: {e}")
+
+async def persistence_task():
+    while True:
+        t = stats.start()
+        while len(pending):
+            record = pending.peek()
+            values = struct.unpack(RECORD_FMT, record)  # once, for the compressor and both rollups
+            if compressor is not None:
+                compressor.add(record, values, store_reading)
+            else:
+                store_reading(record)
+            try:
+                # Closing a bucket stores it and queues it for upload
+                minutes.add(values)
+                hours.add(values)
+            except Exception as e:
+                print(f"Error writing rollups: {e}")
+            pending.pop()
+        checkpoint_state()
+        stats.observe("persist", t)
+        await asyncio.sleep_ms(PERSIST_PERIOD_MS)
+
+# --- Wi‑Fi / NTP: LED indicator, retry every 60s, hourly NTP sync ---
+async def wifi_task():
+    led_state = 0
+    last_wifi_attempt = time.time()
+    last_ntp_sync = 0
+    while True:
+        if led_state == 0 and wlan.isconnected():
+            led.value(1)
+            led_state = 1
+            print(wlan.ifconfig())
+            print("Open in browser:", "http://{}".format(wlan.ifconfig()[0]))
+        elif led_state == 1 and not wlan.isconnected():
+            led.value(0)
+            led_state = 0
+
+        if (time.time() - last_wifi_attempt) > 60:
+            if not wlan.isconnected():
+                connect_wifi()
+            elif (time.time() - last_ntp_sync) > 3600:
+                t = stats.start()
                 try:
                     ntptime.settime()
                     last_ntp_sync = time.time()
                     print("RTC synced (UTC):", time.localtime())
+                    checkpoint_state(force=True)
                 except Exception:
                     print("NTP sync failed")
-        last_wifi_attempt = time.time()
-    
-    # Firestore sync every 60 seconds (only when WiFi is connected)
-    if firebase and wlan.isconnected() and (time.time() - last_firebase_sync) > 60:
-        try:
-            with open("pending_upload.json", "r") as f:
-                upload_data = ujson.load(f)
-            
-            # Send to Firestore - creates a new document with auto-generated ID
-            if firebase.send_data("air_quality_readings", upload_data):
-                print(f"Firestore sync OK: {upload_data['timestamp']}")
-            else:
-                print("Firestore sync failed - will retry in 60s")
-                
-        except Exception as e:
-            print(f"Firestore sync error: {e}")
-        
-        last_firebase_sync = time.time()
+                stats.observe("ntp", t)
+            last_wifi_attempt = time.time()
+        await asyncio.sleep_ms(WIFI_PERIOD_MS)
 
-    # Web server (non-blocking accept)
-    
+# --- Uploader: latest-values document, then the Firestore outboxes under a shared time budget ---
+# (Firestore I/O is awaited on uasyncio streams, so sampling, LCD and web keep running)
+def upload_queued():
+    return sum(len(o) for o, _ in uploads)
+
+def latest_summary():
+    """Latest-values document (LATEST_SCHEMA keys): current reading, IAQ class and min/max over LATEST_WINDOW_S"""
+    values = {"ts": reading.ts, "temp": reading.temp, "hum": reading.hum, "pres": reading.pres,
+              "gas": reading.gas, "iaq": IAQ_LABELS[reading.iaq], "window_s": LATEST_WINDOW_S}
+    count, summary = hours.summary(reading.ts - LATEST_WINDOW_S)
+    if count:
+        values["samples"] = count
+        for field in summary:
+            values[field + "_min"], values[field + "_max"], _ = summary[field]
+    return values
+
+async def upload_task():
+    latest_at = None    # ticks of the last latest-values update
+    while True:
+        delay = UPLOAD_PERIOD_MS
+        now = time.ticks_ms()
+        if reading.seq and wlan.isconnected() and (
+                latest_at is None or time.ticks_diff(now, latest_at) >= LATEST_PERIOD_MS):
+            latest_at = now
+            t = stats.start()
+            if not await latest.publish(firebase, latest_summary()):
+                delay = 60000
+            stats.observe("upload", t)
+        if upload_queued() and wlan.isconnected() and delay == UPLOAD_PERIOD_MS:
+            t = stats.start()
+            start = time.ticks_ms()
+            for box, collection in uploads:
+                budget = UPLOAD_BUDGET_MS - time.ticks_diff(time.ticks_ms(), start)
+                if not len(box) or budget <= 0:
+                    continue
+                try:
+                    sent = await box.drain(firebase, collection, budget_ms=budget)
+                    if sent:
+                        print(f"Firestore sync OK: {sent} sent to {collection}, {len(box)} queued")
+                    elif len(box):
+                        print("Firestore sync failed - will retry in 60s")
+                        delay = 60000
+                        break
+                except Exception as e:
+                    print(f"Firestore sync error: {e}")
+                    delay = 60000
+                    break
+            stats.observe("upload", t)
+        await asyncio.sleep_ms(delay)
+
+# --- Web server ---
+def data_json():
+    """Latest reading and system info as compact JSON (a view into json_buf)"""
+    utc = system["utc"]
+    return json_into(json_buf, reading, time.gmtime(utc) if utc is not None else None, system["uptime"],
+                     system["chip_temp"], system["wifi"]).view()
+
+async def serve_index(request, response):
+    # Static shell: the browser revalidates with If-None-Match and usually gets a 304
+    await response.send_cached(request, web_page.INDEX_HTML, web_page.INDEX_ETAG,
+                               headers={"Cache-Control": "no-cache"},
+                               gzip_body=web_page.INDEX_HTML_GZ)
+
+async def serve_data(request, response):
+    # The ETag changes with every new sample, so polling between samples costs a 304
+    await response.send_cached(request, data_json, '"%d.%d"' % (start_time, reading.seq),
+                               content_type="application/json",
+                               headers={"Access-Control-Allow-Origin": "*", "Cache-Control": "no-cache"})
+
+HISTORY_CHUNK = 512  # bytes of rows collected before sending a chunk
+
+async def serve_history(request, response):
+    """Stream logged readings between ?from= and ?to= (UTC epoch seconds) as JSON,
+    at most one row per ?step= seconds. Memory use does not depend on the range."""
     try:
-        cl, caddr = s.accept()        # will block up to s.gettimeout()
-        print("Client from", caddr)
-        cl.settimeout(1.0)            # short timeout for recv
-        try:
-            req = cl.recv(1024).decode()
-        except OSError:
-            print("recv timeout or error from", caddr)
-            cl.close()
-            raise
-        
-        if req.startswith("GET /reboot"):
-            html = "<html><head><meta charset='utf-8'><title>Rebooting</title></head><body><h1>Rebooting...</h1></body></html>"
-            headers = ("HTTP/1.1 200 OK\r\n"
-                       "Content-Type: text/html; charset=utf-8\r\n"
-                       "Connection: close\r\n\r\n")
-            try:
-                cl.send((headers + html).encode("utf-8"))
-            except Exception:
-                pass
-            try:
-                cl.close()      # close client socket
-            except Exception:
-                pass
-            try:
-                s.close()       # close listening socket if you can (optional)
-            except Exception:
-                pass
-            import time, machine
-            time.sleep(0.3)     # give TCP a moment to flush
-            machine.reset()
-        else:
-            local_time_str = "{:02d}:{:02d}:{:02d} — {:02d}-{:02d}-{:04d}".format(
-                local[3], local[4], local[5], local[2], local[1], local[0]
-            )
-
-            time_short    = sys_data.get("time", "--:--")
-            time_sec      = sys_data.get("time_sec", "--:--:--")
-            date_str      = sys_data.get("date", "--")
-            uptime_str    = str(sys_data.get("uptime_sec", "--"))
-            wifi_str      = sys_data.get("wifi", "OFF")
-            chip_temp_str = str(sys_data.get("chip_temp", "--"))
-            chip_str      = sys_data.get("chip", "RP2040")
-
-            html_body = (
-                '<html><head><title>Pico W Dashboard</title>'
-                '<meta http-equiv="refresh" content="10">'
-                '<style>'
-                'body{font-family:Arial,Helvetica,sans-serif;background:#f5f7fb;padding:20px;color:#111}'
-                'table{border-collapse:collapse;width:480px;background:#fff;margin-bottom:16px}'
-                'th,td{border:1px solid #e5e7eb;padding:8px 10px;text-align:left}'
-                'th{background:#f9fafb}'
-                '.sub{color:#6b7280;margin-bottom:12px}'
-                'a.button{display:inline-block;padding:8px 12px;background:#2563eb;color:#fff;text-decoration:none;border-radius:6px}'
-                '</style></head><body>'
-                '<h1>Pico W System Dashboard</h1>'
-                '<div class="sub">Local: %s</div>'
-                '<table>'
-                '<tr><th>Field</th><th>Value</th></tr>'
-                '<tr><td>UTC time</td><td>%s %s</td></tr>'
-                '<tr><td>Uptime (sec)</td><td>%s</td></tr>'
-                '<tr><td>Chip temperature</td><td>%s °C</td></tr>'
-                '</table>'
-                '<form action="/reboot" method="get" onsubmit="return confirm(\'Reboot Pico W now?\');" style="margin-top:12px">'
-                '  <button type="submit" style="padding:8px 12px;background:#ef4444;color:#fff;border:none;border-radius:6px;cursor:pointer;">'
-                '    Reboot device'
-                '  </button>'
-                '</form>'
-                '</body></html>'
-            ) % (
-                local_time_str,
-                time_sec, date_str,
-                uptime_str,
-                chip_temp_str
-            )
-             
-            response = (
-                "HTTP/1.1 200 OK\r\n"
-                "Content-Type: text/html; charset=utf-8\r\n"
-                "Connection: close\r\n\r\n"
-                +html_body
-            )
-            cl.send(response.encode("utf-8"))
-        cl.close()
-          
-    except OSError:
-        pass
-
-    # Rotate LCD mode
-    time.sleep(6)
-    idx = (idx + 1) % len(modes)
+        t_from = int(request.query.get("from", 0))
+        t_to = int(request.query["to"]) if "to" in request.query else None
+        step = max(0, int(request.query.get("step", 0)))
+    except ValueError:
+        await response.send("Bad parameters", 400, "text/plain")
+        return
+    start = sensor_log.find(t_from)  # binary search over the stored timestamps
+    await response.start_chunked(content_type="application/json",
+                                 headers={"Access-Control-Allow-Origin": "*"})
+    await response.write_chunk(b'{"fields":["ts","temp","hum","pres","gas","iaq"],"rows":[')
+    parts = []
+    size = 0
+    sep = ""
+    next_ts = t_from
+    scanned = 0
+    for _, record in sensor_log.records(start):
+        ts = record[0]
+        if t_to is not None and ts > t_to:
+            break
+        scanned += 1
+        if ts >= next_ts:
+            next_ts = ts + step
+            code = record[5]
+            row = '%s[%d,%.2f,%.2f,%.1f,%d,"%s"]' % (
+                sep, ts, record[1], record[2], record[3], record[4],
+                IAQ_LABELS[code] if code < len(IAQ_LABELS) else "?")
+            sep = ","
+            parts.append(row)
+            size += len(row)
+            if size >= HISTORY_CHUNK:
+                await response.write_chunk("".join(parts).encode())
+                parts = []
+                size = 0
+        elif scanned % 64 == 0:
+            await asyncio.sleep_ms(0)  # long skipped stretches still let other tasks run
+    await response.write_chunk(("".join(parts) + "]}").encode())
+    await response.end_chunked()
+
+async def serve_stats(request, response):
+    """Min/max/mean of each field over the last ?window= seconds (default 3600).
+    Answered from the readings in RAM when they cover the window, otherwise from
+    the stored minute (up to 6 h) or hour buckets."""
+    try:
+        window = int(request.query.get("window", 3600))
+    except ValueError:
+        await response.send("Bad parameters", 400, "text/plain")
+        return
+    since = reading.ts - window
+    oldest = history.oldest()
+    if oldest is not None and oldest <= since:
+        source = "raw"
+        count = 0
+        summary = {}
+        for field in HISTORY_FIELDS:
+            s = history.stats(field, since)
+            if s:
+                count = s[3]
+                summary[field] = s[:3]
+    else:
+        source = "minute" if window <= 6 * 3600 else "hour"
+        count, summary = (minutes if source == "minute" else hours).summary(since)
+    parts = ['{"window":%d,"since":%d,"source":"%s"' % (window, since, source)]
+    for field in summary:
+        parts.append(',"%s":{"min":%.2f,"max":%.2f,"mean":%.2f}' % ((field,) + tuple(summary[field])))
+    parts.append(',"count":%d}' % count)
+    await response.send("".join(parts), content_type="application/json",
+                        headers={"Access-Control-Allow-Origin": "*", "Cache-Control": "no-cache"})
+
+async def serve_rollups(request, response):
+    """Stream stored buckets of ?period=minute|hour (default hour) between ?from=
+    and ?to= (UTC epoch seconds) as JSON rows of count and min/max/mean per field"""
+    rollup = minutes if request.query.get("period") == "minute" else hours
+    try:
+        t_from = int(request.query.get("from", 0))
+        t_to = int(request.query["to"]) if "to" in request.query else None
+    except ValueError:
+        await response.send("Bad parameters", 400, "text/plain")
+        return
+    await response.start_chunked(content_type="application/json",
+                                 headers={"Access-Control-Allow-Origin": "*"})
+    await response.write_chunk(('{"period":%d,"fields":["start","count"' % rollup.period).encode())
+    await response.write_chunk("".join(',"%s_min","%s_max","%s_mean"' % (f, f, f)
+                                       for f in ROLLUP_FIELDS).encode() + b'],"rows":[')
+    sep = ""
+    for bucket in rollup.buckets(t_from, t_to):
+        row = sep + "[%d,%d" % (bucket[0], bucket[1]) + "".join(
+            ",%.2f" % v for v in bucket[2:]) + "]"
+        sep = ","
+        await response.write_chunk(row.encode())
+    await response.write_chunk(b"]}")
+    await response.end_chunked()
+
+async def serve_reboot(request, response):
+    response.keep_alive = False
+    await response.send(web_page.REBOOT_HTML)
+    asyncio.create_task(reboot_soon())
+
+async def reboot_soon():
+    if compressor is not None:
+        compressor.flush(store_reading)  # the newest reading is still held back
+    checkpoint_state(force=True)
+    await asyncio.sleep_ms(300)  # give TCP a moment to flush
+    import machine
+    machine.reset()
+
+async def serve_metrics(request, response):
+    await response.start_chunked(content_type="text/plain; version=0.0.4")
+    for piece in stats.render():
+        await response.write_chunk(piece.encode())
+    await response.end_chunked()
+
+def timed(handler):
+    """Wrap a request handler so its duration is recorded as the "http" stage"""
+    async def wrapper(request, response):
+        t = stats.start()
+        await handler(request, response)
+        stats.observe("http", t)
+    return wrapper
 
+web = WebServer(PORT, max_clients=8)
+events = EventStream(max_subscribers=4, current=data_json)
+web.route("/", timed(serve_index))
+web.route("/data", timed(serve_data))
+web.route("/history", timed(serve_history))
+web.route("/stats", timed(serve_stats))
+web.route("/rollups", timed(serve_rollups))
+web.route("/events", events.handler)  # open-ended stream, not timed
+web.route("/metrics", serve_metrics)
+web.route("/reboot", serve_reboot)
+
+stats.register("http_requests_total", "counter", "HTTP requests received", lambda: web.requests)
+stats.register("sse_dropped_total", "counter", "Event stream subscribers dropped as too slow",
+               lambda: events.dropped)
+stats.register("sample_interval_seconds", "gauge", "Current sampling interval",
+               lambda: schedule.interval_ms / 1000)
+stats.register("sample_deadlines_missed_total", "counter", "Sampling deadlines missed by more than an interval",
+               lambda: schedule.late)
+stats.register("samples_dropped_total", "counter", "Readings dropped before they reached flash",
+               lambda: pending.dropped + (shared.dropped if shared else 0))
+stats.register("flash_state_bytes_total", "counter", "Bytes written to state checkpoints",
+               lambda: state.bytes_written)
+stats.register("checkpoints_total", "counter", "State checkpoints written", lambda: state.writes)
+stats.register("flash_log_bytes_total", "counter", "Bytes written to data.log", lambda: sensor_log.bytes_written)
+if compressor is not None:
+    stats.register("compression_received_total", "counter", "Readings given to the compressor",
+                   lambda: compressor.received)
+    stats.register("compression_kept_total", "counter", "Readings kept by the compressor",
+                   lambda: compressor.kept)
+    stats.register("compression_ratio", "gauge", "Readings received per reading kept",
+                   lambda: compressor.ratio)
+stats.register("flash_rollup_bytes_total", "counter", "Bytes written to minutes.log and hours.log",
+               lambda: minutes.log.bytes_written + hours.log.bytes_written)
+if firebase is not None:
+    stats.register("flash_outbox_bytes_total", "counter", "Bytes written to the upload outboxes",
+                   lambda: sum(o.bytes_written for o, _ in uploads))
+    stats.register("upload_queued", "gauge", "Readings and buckets waiting in the upload outboxes", upload_queued)
+    stats.register("upload_failures_total", "counter", "Failed Firestore requests",
+                   lambda: firebase.failures)
+    stats.register("latest_writes_total", "counter", "Updates of the latest-values document",
+                   lambda: latest.writes)
+    stats.register("tls_handshakes_total", "counter", "TLS handshakes to Firestore",
+                   lambda: firebase.session.handshakes)
+    stats.register("tls_reused_total", "counter", "Firestore requests on a reused connection",
+                   lambda: firebase.session.reused)
+
+async def main():
+    if DUAL_CORE:
+        import _thread
+        stats.stage("sensor")  # observed from core1
+        stats.stage("lcd")
+        _thread.start_new_thread(core1_main, ())
+        asyncio.create_task(receiver_task())
+    else:
+        asyncio.create_task(sampler_task())
+        asyncio.create_task(lcd_task())
+    asyncio.create_task(persistence_task())
+    asyncio.create_task(wifi_task())
+    if uploads:
+        asyncio.create_task(upload_task())
+    await web.start()
+    print("Web server ready on port", PORT)
+    while True:
+        await asyncio.sleep(3600)
+
+try:
+    asyncio.run(main())
+finally:
+    asyncio.new_event_loop()  # clear loop state when re-run from the REPL
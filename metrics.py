@@ -0,0 +1,182 @@
+# metrics.py
+# Lightweight runtime instrumentation: per-stage latency histograms (time.ticks_us),
+# counters, heap watermarks, and Prometheus text exposition for /metrics
+
+import gc
+import time
+from array import array
+try:
+    import _thread
+except ImportError:
+    _thread = None
+
+# Histogram bucket upper bounds in microseconds (1 ms ... 10 s)
+BUCKETS_US = (1000, 5000, 10000, 25000, 50000, 100000, 250000, 500000,
+              1000000, 2500000, 5000000, 10000000)
+
+PREFIX = "aq_"
+
+
+class Histogram:
+    def __init__(self, buckets_us=BUCKETS_US):
+        """Fixed-size latency histogram; observing never allocates"""
+        self.buckets_us = buckets_us
+        self.counts = array("L", [0] * (len(buckets_us) + 1))  # last slot: +Inf
+        self.sum_us = 0
+        self.max_us = 0
+
+    def observe_us(self, us):
+        i = 0
+        n = len(self.buckets_us)
+        while i < n and us > self.buckets_us[i]:
+            i += 1
+        self.counts[i] += 1
+        self.sum_us += us
+        if us > self.max_us:
+            self.max_us = us
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+
+class Metrics:
+    def __init__(self):
+        self.stages = {}     # stage name -> Histogram
+        self.counters = {}   # name -> [description, value]
+        self.sources = []    # (name, type, description, function returning the value)
+        self.mem_free_min = None
+        self.mem_alloc_max = 0
+        # observe() and inc() may run on both cores (DUAL_CORE in main.py)
+        self.lock = _thread.allocate_lock() if _thread else _NoLock()
+
+    def start(self):
+        """Start timing a stage; pass the result to observe()"""
+        return time.ticks_us()
+
+    def stage(self, name):
+        """Histogram of a stage, created on first use. Create stages observed from
+        another thread up front, so the dict does not change while it is rendered."""
+        hist = self.stages.get(name)
+        if hist is None:
+            hist = self.stages[name] = Histogram()
+        return hist
+
+    def observe(self, stage, started):
+        """Record the time since `started` (from start()) under a stage name"""
+        us = time.ticks_diff(time.ticks_us(), started)
+        hist = self.stage(stage)
+        with self.lock:
+            hist.observe_us(us)
+
+    def counter(self, name, description):
+        """Declare a counter so it is exported (as 0) before the first inc()"""
+        if name not in self.counters:
+            self.counters[name] = [description, 0]
+
+    def inc(self, name, n=1):
+        with self.lock:
+            self.counters[name][1] += n
+
+    def register(self, name, kind, description, fn):
+        """
+        Export a value owned by another object.
+
+        Args:
+            name: Metric name without prefix
+            kind: "counter" or "gauge"
+            description: Description
+            fn: Function returning the current value
+        """
+        self.sources.append((name, kind, description, fn))
+
+    def sample_memory(self):
+        """Update the heap low/high watermarks from gc.mem_free()/gc.mem_alloc()"""
+        free = gc.mem_free()
+        alloc = gc.mem_alloc()
+        if self.mem_free_min is None or free < self.mem_free_min:
+            self.mem_free_min = free
+        if alloc > self.mem_alloc_max:
+            self.mem_alloc_max = alloc
+
+    def render(self):
+        """Yield the Prometheus text exposition format in small pieces"""
+        self.sample_memory()
+        if self.stages:
+            name = PREFIX + "stage_seconds"
+            yield "# HELP %s Duration of main loop stages\n# TYPE %s histogram\n" % (name, name)
+            for stage in self.stages:
+                hist = self.stages[stage]
+                with self.lock:  # a consistent copy of the buckets, sum and count
+                    counts = list(hist.counts)
+                    sum_us = hist.sum_us
+                lines = []
+                cumulative = 0
+                for i in range(len(hist.buckets_us)):
+                    cumulative += counts[i]
+                    lines.append('%s_bucket{stage="%s",le="%g"} %d\n' % (
+                        name, stage, hist.buckets_us[i] / 1000000, cumulative))
+                cumulative += counts[-1]
+                lines.append('%s_bucket{stage="%s",le="+Inf"} %d\n' % (name, stage, cumulative))
+                lines.append('%s_sum{stage="%s"} %g\n' % (name, stage, sum_us / 1000000))
+                lines.append('%s_count{stage="%s"} %d\n' % (name, stage, cumulative))
+                yield "".join(lines)
+            name = PREFIX + "stage_max_seconds"
+            yield "# HELP %s Longest observed duration per stage\n# TYPE %s gauge\n" % (name, name)
+            for stage in self.stages:
+                yield '%s{stage="%s"} %g\n' % (name, stage, self.stages[stage].max_us / 1000000)
+        for key in self.counters:
+            description, value = self.counters[key]
+            yield _metric(key, "counter", description, value)
+        for key, kind, description, fn in self.sources:
+            yield _metric(key, kind, description, fn())
+        yield _metric("mem_free_bytes", "gauge", "Current gc.mem_free()", gc.mem_free())
+        yield _metric("mem_alloc_bytes", "gauge", "Current gc.mem_alloc()", gc.mem_alloc())
+        yield _metric("mem_free_min_bytes", "gauge", "Lowest observed gc.mem_free()", self.mem_free_min)
+        yield _metric("mem_alloc_max_bytes", "gauge", "Highest observed gc.mem_alloc()", self.mem_alloc_max)
+
+
+class _NoLock:
+    """Stands in for a _thread lock on ports without threads"""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+def _metric(name, kind, description, value):
+    name = PREFIX + name
+    return "# HELP %s %s\n# TYPE %s %s\n%s %s\n" % (name, description, name, kind, name, value)
+
+
+class CountingI2C:
+    def __init__(self, i2c, metrics, name="i2c_transactions_total"):
+        """
+        Wrap a machine.I2C bus and count its transactions in `metrics`.
+
+        Args:
+            i2c: machine.I2C instance
+            metrics: Metrics instance
+            name: Counter name
+        """
+        self._i2c = i2c
+        self._metrics = metrics
+        self._name = name
+        metrics.counter(name, "I2C bus transactions")
+
+    def writeto(self, addr, buf, stop=True):
+        self._metrics.inc(self._name)
+        return self._i2c.writeto(addr, buf, stop)
+
+    def readfrom_into(self, addr, buf, stop=True):
+        self._metrics.inc(self._name)
+        return self._i2c.readfrom_into(addr, buf, stop)
+
+    def writeto_mem(self, addr, memaddr, buf, **kwargs):
+        self._metrics.inc(self._name)
+        return self._i2c.writeto_mem(addr, memaddr, buf, **kwargs)
+
+    def readfrom_mem_into(self, addr, memaddr, buf, **kwargs):
+        self._metrics.inc(self._name)
+        return self._i2c.readfrom_mem_into(addr, memaddr, buf, **kwargs)
@@ -0,0 +1,237 @@
+# reading.py
+# The latest sample as one mutable record that is overwritten every period (and
+# how a sensor snapshot is turned into it: local time, IAQ class), a
+# fixed queue of packed records for the persistence task (and locked ones for
+# handing readings and values between cores), and formatters that render into TextBuffers
+# (LCD lines, /data JSON)
+
+import time
+from array import array
+try:
+    import struct
+except ImportError:
+    import ustruct as struct
+try:
+    import _thread
+except ImportError:
+    _thread = None
+
+from ring_log import RECORD_FMT, IAQ_LABELS
+from dst import local_epoch
+
+IAQ_BYTES = tuple(label.encode() for label in IAQ_LABELS)
+GAS_STEP = 0    # heater profile step whose gas readings are used (multi-step profiles cycle)
+RECORD_SIZE = struct.calcsize(RECORD_FMT)
+
+
+class Reading:
+    def __init__(self):
+        """Latest sensor sample; update() overwrites it in place"""
+        self.seq = 0         # incremented with every update (0: no sample yet)
+        self.local = None    # local time tuple (shown on the LCD and in /data)
+        self.ts = 0          # UTC epoch seconds (stored, ordered)
+        self.temp = 0.0
+        self.hum = 0.0
+        self.pres = 0.0
+        self.gas = 0
+        self.iaq = 0         # index into IAQ_LABELS
+        self.record = bytearray(RECORD_SIZE)  # the same sample packed as a sensor log record
+
+    def update(self, local, ts, temp, hum, pres, gas, iaq):
+        self.local = local
+        self.ts = ts
+        self.temp = temp
+        self.hum = hum
+        self.pres = pres
+        self.gas = gas
+        self.iaq = iaq
+        struct.pack_into(RECORD_FMT, self.record, 0, ts, temp, hum, pres, gas, iaq)
+        self.seq += 1
+
+    def load(self, record):
+        """Update from a packed record produced elsewhere (e.g. on the other core)"""
+        ts, temp, hum, pres, gas, iaq = struct.unpack(RECORD_FMT, record)
+        self.update(time.gmtime(local_epoch(ts)), ts, temp, hum, pres, gas, iaq)
+
+
+def calculate_iaq(humidity, gas_res):
+    """IAQ class label (one of IAQ_LABELS) from humidity (%) and gas resistance (ohms)"""
+    humidity_baseline = 40
+    humidity_weighting = 0.25
+    humidity_offset = humidity - humidity_baseline
+    if humidity_offset > 0:
+        humidity_score = (100 - humidity_baseline - humidity_offset) / \
+                         (100 - humidity_baseline) * (humidity_weighting * 100)
+    else:
+        humidity_score = (humidity_baseline + humidity_offset) / \
+                         humidity_baseline * (humidity_weighting * 100)
+    gas_score = min((gas_res / 100000.0), 1.0) * (100 - (humidity_weighting * 100))
+    iaq = humidity_score + gas_score
+    if iaq >= 80: return "Good"
+    elif iaq >= 60: return "Avg"
+    elif iaq >= 40: return "Poor"
+    else: return "Bad"
+
+
+def update_reading(r, snapshot, now):
+    """Fill Reading r from a BME680 snapshot whose measurement started at UTC epoch `now`"""
+    hum = snapshot.humidity
+    gas = snapshot.gas
+    if r.seq and (snapshot.gas_step != GAS_STEP or not snapshot.gas_valid
+                  or not snapshot.heat_stable):
+        # Another heater temperature, or the heater did not reach its target:
+        # keep the last comparable value rather than report it as a change
+        gas = r.gas
+    iaq = IAQ_LABELS.index(calculate_iaq(hum, gas))
+    r.update(time.gmtime(local_epoch(now)), now, snapshot.temperature, hum,
+             snapshot.pressure, gas, iaq)
+
+
+class RecordQueue:
+    def __init__(self, slots=4, record_size=RECORD_SIZE):
+        """
+        Fixed ring of packed records handed from the sampler to the persistence task.
+
+        Args:
+            slots: Records held; the oldest is dropped when a new one does not fit
+            record_size: Bytes per record
+        """
+        self.slots = slots
+        self.record_size = record_size
+        self.buf = bytearray(slots * record_size)
+        self.mv = memoryview(self.buf)
+        self.first = 0
+        self.count = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return self.count
+
+    def push(self, record):
+        """Copy one packed record into the queue"""
+        if self.count == self.slots:
+            self.first = (self.first + 1) % self.slots
+            self.count -= 1
+            self.dropped += 1
+        size = self.record_size
+        offset = ((self.first + self.count) % self.slots) * size
+        buf = self.buf
+        for i in range(size):
+            buf[offset + i] = record[i]
+        self.count += 1
+
+    def peek(self):
+        """Oldest queued record (a view into the queue; valid until pop())"""
+        offset = self.first * self.record_size
+        return self.mv[offset:offset + self.record_size]
+
+    def pop(self):
+        self.first = (self.first + 1) % self.slots
+        self.count -= 1
+
+
+class SharedRecordQueue(RecordQueue):
+    def __init__(self, slots=16, record_size=RECORD_SIZE):
+        """RecordQueue for two threads (cores): one calls push(), the other take()"""
+        super().__init__(slots, record_size)
+        self.lock = _thread.allocate_lock()
+
+    def push(self, record):
+        with self.lock:
+            RecordQueue.push(self, record)
+
+    def take(self, out):
+        """
+        Copy the oldest record into `out` and remove it from the queue.
+
+        Returns:
+            False if the queue was empty
+        """
+        with self.lock:
+            if not self.count:
+                return False
+            offset = self.first * self.record_size
+            buf = self.buf
+            for i in range(self.record_size):
+                out[i] = buf[offset + i]
+            self.pop()
+        return True
+
+
+
+class SharedValues:
+    def __init__(self, count):
+        """Fixed set of floats written by one thread (core) and read by the other"""
+        self.values = array("f", [0] * count)
+        self.valid = False   # False until the first set()
+        self.lock = _thread.allocate_lock()
+
+    def set(self, *values):
+        with self.lock:
+            for i in range(len(values)):
+                self.values[i] = values[i]
+            self.valid = True
+
+    def get(self, out):
+        """
+        Copy the values into `out` (an array of the same length).
+
+        Returns:
+            False if set() was never called
+        """
+        with self.lock:
+            for i in range(len(out)):
+                out[i] = self.values[i]
+            return self.valid
+
+
+def lcd_time_line(out, local):
+    """HH:MM DD-MM-YYYY"""
+    out.clear().integer(local[3], 2).text(b":").integer(local[4], 2).text(b" ")
+    out.integer(local[2], 2).text(b"-").integer(local[1], 2).text(b"-").integer(local[0], 4)
+    return out.pad()
+
+
+def lcd_air_line(out, r):
+    """Temperature and air quality class, e.g. "22.81 C Good Air" """
+    out.clear().fixed(r.temp, 2).text(b" C ").text(IAQ_BYTES[r.iaq]).text(b" Air")
+    return out.pad()
+
+
+def lcd_humidity_line(out, r):
+    """Humidity and pressure, e.g. "44.60% 1012 hPa" """
+    out.clear().fixed(r.hum, 2).text(b"% ").fixed(r.pres, 0).text(b" hPa")
+    return out.pad()
+
+
+def lcd_average_line(out, temp_mean, hum_mean):
+    """One hour averages, e.g. "1h avg 22.5C 45%" """
+    out.clear().text(b"1h avg ").fixed(temp_mean, 1).text(b"C ").fixed(hum_mean, 0).text(b"%")
+    return out.pad()
+
+
+def _utc_text(out, utc):
+    # "HH:MM:SS DD-MM-YYYY"
+    out.integer(utc[3], 2).text(b":").integer(utc[4], 2).text(b":").integer(utc[5], 2).text(b" ")
+    out.integer(utc[2], 2).text(b"-").integer(utc[1], 2).text(b"-").integer(utc[0], 4)
+
+
+def json_into(out, r, utc, uptime, chip_temp, wifi):
+    """Latest reading and system info as compact JSON (the /data response)"""
+    out.clear()
+    if not r.seq:
+        return out.text(b"{}")
+    local = r.local
+    out.text(b'{"time":"').integer(local[0], 4).text(b"-").integer(local[1], 2).text(b"-")
+    out.integer(local[2], 2).text(b"T").integer(local[3], 2).text(b":").integer(local[4], 2)
+    out.text(b":").integer(local[5], 2)
+    out.text(b'","temp":').fixed(r.temp, 2).text(b',"hum":').fixed(r.hum, 2)
+    out.text(b',"pres":').fixed(r.pres, 1).text(b',"gas":').integer(r.gas)
+    out.text(b',"iaq":"').text(IAQ_BYTES[r.iaq]).text(b'","utc":"')
+    if utc:
+        _utc_text(out, utc)
+    else:
+        out.text(b"--:--:-- --")
+    out.text(b'","uptime":').integer(uptime).text(b',"chip_temp":').fixed(chip_temp, 2)
+    return out.text(b',"wifi":"').text(b"OK" if wifi else b"OFF").text(b'"}')
+
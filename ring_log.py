@@ -0,0 +1,179 @@
+# ring_log.py
+# Fixed-record, append-only ring log on flash
+#
+# File layout: a small header followed by `capacity` slots of `struct.calcsize(fmt)`
+# bytes each. The header holds two free-running sequence numbers: `head` (next
+# record to be written) and `tail` (oldest record still kept). Slot = seq % capacity.
+# Appending writes one record plus the header, so cost per reading is constant
+# regardless of how much history is stored.
+
+try:
+    import struct
+except ImportError:
+    import ustruct as struct
+
+_MAGIC = b"RLOG"
+_HEADER_FMT = "<4sHHIII"  # magic, version, record size, capacity, head, tail
+_HEADER_SIZE = struct.calcsize(_HEADER_FMT)
+_VERSION = 2  # 2: record timestamps are UTC (version 1 logs held local time and are reset)
+
+# Sensor log record: UTC epoch seconds, temp C, humidity %, pressure hPa,
+# gas ohms, IAQ class code (index into IAQ_LABELS)
+RECORD_FMT = "<IfffIB"
+IAQ_LABELS = ("Good", "Avg", "Poor", "Bad")
+
+
+class RingLog:
+    def __init__(self, path, fmt=RECORD_FMT, capacity=4096):
+        """
+        Open (or create) a ring log file.
+
+        Args:
+            path: File name on flash (e.g., "data.log")
+            fmt: struct format of one record
+            capacity: Number of record slots; oldest records are overwritten when full
+
+        An existing file whose record size or capacity differs is reinitialised.
+        """
+        self.path = path
+        self.fmt = fmt
+        self.record_size = struct.calcsize(fmt)
+        self.capacity = capacity
+        self.head = 0
+        self.tail = 0
+        self.bytes_written = 0
+        self._header = bytearray(_HEADER_SIZE)
+        self._record = bytearray(self.record_size)
+        self._file = None
+        self._open()
+
+    def _open(self):
+        try:
+            f = open(self.path, "r+b")
+            n = f.readinto(self._header)
+            if n == _HEADER_SIZE:
+                magic, version, size, capacity, head, tail = struct.unpack(_HEADER_FMT, self._header)
+                if (magic == _MAGIC and version == _VERSION and size == self.record_size
+                        and capacity == self.capacity and 0 <= head - tail <= capacity):
+                    self._file = f
+                    self.head = head
+                    self.tail = tail
+                    return
+            f.close()
+        except OSError:
+            pass
+        # Missing or incompatible file: start a new, empty log
+        self._file = open(self.path, "w+b")
+        self.head = 0
+        self.tail = 0
+        self._write_header()
+
+    def _write_header(self):
+        struct.pack_into(_HEADER_FMT, self._header, 0, _MAGIC, _VERSION,
+                         self.record_size, self.capacity, self.head, self.tail)
+        self._file.seek(0)
+        self._file.write(self._header)
+        self._file.flush()
+        self.bytes_written += _HEADER_SIZE
+
+    def _offset(self, seq):
+        return _HEADER_SIZE + (seq % self.capacity) * self.record_size
+
+    def __len__(self):
+        return self.head - self.tail
+
+    def append(self, *values):
+        """
+        Append one record.
+
+        Args:
+            *values: Field values matching `fmt`
+
+        Returns:
+            Sequence number of the new record
+        """
+        struct.pack_into(self.fmt, self._record, 0, *values)
+        return self.append_packed(self._record)
+
+    def append_packed(self, record):
+        """Append one already packed record (bytes-like of `record_size` bytes)"""
+        seq = self.head
+        self._file.seek(self._offset(seq))
+        self._file.write(record)
+        self.bytes_written += self.record_size
+        self.head = seq + 1
+        if self.head - self.tail > self.capacity:
+            self.tail = self.head - self.capacity
+        self._write_header()
+        return seq
+
+    def read(self, seq):
+        """
+        Read the record with sequence number `seq`.
+
+        Returns:
+            Tuple of field values
+
+        Raises:
+            IndexError if the record is no longer (or not yet) in the log
+        """
+        if not self.tail <= seq < self.head:
+            raise IndexError("sequence out of range")
+        self._file.seek(self._offset(seq))
+        self._file.readinto(self._record)
+        return struct.unpack(self.fmt, self._record)
+
+    def records(self, start=None, stop=None):
+        """
+        Iterate over stored records oldest first without loading the file into RAM.
+
+        Args:
+            start: First sequence number (default: oldest kept record)
+            stop: Sequence number to stop before (default: head at call time)
+
+        Yields:
+            (seq, values) tuples
+        """
+        seq = self.tail if start is None else max(start, self.tail)
+        stop = self.head if stop is None else min(stop, self.head)
+        buf = bytearray(self.record_size)
+        with open(self.path, "rb") as f:
+            while seq < stop:
+                if seq < self.tail:
+                    # Overwritten while iterating; skip ahead to the oldest kept record
+                    seq = self.tail
+                    continue
+                f.seek(self._offset(seq))
+                f.readinto(buf)
+                yield seq, struct.unpack(self.fmt, buf)
+                seq += 1
+
+    def find(self, value, field=0):
+        """
+        Binary search for the first record whose `field` is >= value.
+
+        Records must be appended in non-decreasing order of that field
+        (e.g., field 0 = timestamp of the sensor log).
+
+        Returns:
+            Sequence number of the first match, or `head` if there is none
+        """
+        lo = self.tail
+        hi = self.head
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.read(mid)[field] < value:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def discard(self, count):
+        """Drop the `count` oldest records (advances the tail pointer)"""
+        self.tail = min(self.tail + count, self.head)
+        self._write_header()
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
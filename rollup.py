@@ -0,0 +1,126 @@
+# rollup.py
+# Incremental per-minute / per-hour aggregates. Each Rollup keeps running
+# min/max/mean/count of the four measurements for the bucket in progress
+# (constant state, updated per sample) and appends every closed bucket to its
+# own ring log on flash, so long-range queries read a few buckets instead of
+# rescanning raw samples.
+
+try:
+    import struct
+except ImportError:
+    import ustruct as struct
+
+from ring_log import RingLog
+
+FIELDS = ("temp", "hum", "pres", "gas")
+# Bucket start (UTC epoch), sample count, then min, max, mean of each field
+ROLLUP_FMT = "<IH" + "fff" * len(FIELDS)
+
+
+class Rollup:
+    def __init__(self, period_s, path, capacity, on_close=None):
+        """
+        Args:
+            period_s: Bucket length in seconds (60, 3600, ...)
+            path: Ring log file for closed buckets
+            capacity: Closed buckets kept on flash
+            on_close: Optional function called with each closed bucket record (packed bytes)
+        """
+        self.period = period_s
+        self.log = RingLog(path, fmt=ROLLUP_FMT, capacity=capacity)
+        self.on_close = on_close
+        self.start = 0
+        self.count = 0
+        n = len(FIELDS)
+        # Lists of floats rather than array("f"): reading an array element
+        # allocates a new float, and add() reads these for every field
+        self.lo = [0.0] * n
+        self.hi = [0.0] * n
+        self.mean = [0.0] * n
+        self._record = bytearray(struct.calcsize(ROLLUP_FMT))
+
+    def add(self, values):
+        """Add one unpacked sensor log record (UTC epoch, then temp, hum, pres, gas);
+        closes the previous bucket when the timestamp leaves it"""
+        ts = values[0]
+        # UTC-aligned buckets; local time differs by whole hours, so minute and
+        # hour buckets are also local minutes and hours
+        start = ts - ts % self.period
+        if self.count and start != self.start:
+            self.close()
+        if not self.count:
+            self.start = start
+        self.count += 1
+        n = self.count
+        for i in range(len(FIELDS)):
+            v = values[i + 1]
+            if n == 1:
+                self.lo[i] = self.hi[i] = self.mean[i] = v
+            else:
+                if v < self.lo[i]:
+                    self.lo[i] = v
+                if v > self.hi[i]:
+                    self.hi[i] = v
+                # Running mean: no large float32 sums that lose precision
+                self.mean[i] += (v - self.mean[i]) / n
+
+    def close(self):
+        """Store the bucket in progress (if any) and start a new one"""
+        if not self.count:
+            return
+        rec = self._record
+        struct.pack_into("<IH", rec, 0, self.start, min(self.count, 0xFFFF))
+        offset = 6
+        for i in range(len(FIELDS)):
+            struct.pack_into("<fff", rec, offset, self.lo[i], self.hi[i], self.mean[i])
+            offset += 12
+        self.count = 0
+        self.log.append_packed(rec)
+        if self.on_close:
+            self.on_close(rec)
+
+    def buckets(self, since=0, until=None):
+        """
+        Closed buckets starting between since and until (UTC epochs), oldest first.
+
+        Yields:
+            (start, count, lo0, hi0, mean0, lo1, ...) tuples
+        """
+        for _, bucket in self.log.records(self.log.find(since - self.period + 1)):
+            if until is not None and bucket[0] > until:
+                break
+            yield bucket
+
+    def summary(self, since=0, until=None):
+        """
+        Combine closed buckets and the bucket in progress over a time window
+        (whole buckets: one that overlaps `since` counts in full).
+
+        Returns:
+            (count, {field: (min, max, mean)}), or (0, {}) if there is no data
+        """
+        n = len(FIELDS)
+        lo = [None] * n
+        hi = [None] * n
+        total = [0.0] * n
+        count = 0
+
+        def merge(c, get):
+            for i in range(n):
+                b_lo, b_hi, b_mean = get(i)
+                if lo[i] is None or b_lo < lo[i]:
+                    lo[i] = b_lo
+                if hi[i] is None or b_hi > hi[i]:
+                    hi[i] = b_hi
+                total[i] += b_mean * c
+
+        for bucket in self.buckets(since, until):
+            merge(bucket[1], lambda i: bucket[2 + 3 * i:5 + 3 * i])
+            count += bucket[1]
+        if self.count and self.start + self.period > since and (until is None or self.start <= until):
+            merge(self.count, lambda i: (self.lo[i], self.hi[i], self.mean[i]))
+            count += self.count
+        if not count:
+            return 0, {}
+        return count, {FIELDS[i]: (lo[i], hi[i], total[i] / count) for i in range(n)}
+
@@ -0,0 +1,97 @@
+# scheduler.py
+# Sampling schedule on absolute deadlines whose interval adapts to how fast
+# the readings change: short while gas resistance or humidity move quickly
+# (measured against a smoothed baseline, above a noise floor), doubling step by
+# step up to a long interval while they are stable
+
+import time
+
+
+class AdaptiveSchedule:
+    def __init__(self, min_ms=2000, base_ms=6000, max_ms=60000,
+                 gas_slope=0.05, hum_slope=1.0, calm_samples=5,
+                 window_ms=60000, gas_floor=0.02, hum_floor=0.5):
+        """
+        Args:
+            min_ms: Interval while readings change quickly
+            base_ms: Interval at start-up
+            max_ms: Longest interval while readings are stable
+            gas_slope: Relative gas resistance change per minute counted as fast (0.05 = 5 %/min)
+            hum_slope: Humidity change per minute counted as fast (%RH/min)
+            calm_samples: Stable samples in a row before the interval is doubled
+            window_ms: Time constant of the smoothed baseline the change is measured against
+            gas_floor: Relative gas change always counted as noise (the compressor tolerance)
+            hum_floor: Humidity change always counted as noise (%RH)
+        """
+        self.min_ms = min_ms
+        self.max_ms = max_ms
+        self.gas_slope = gas_slope
+        self.hum_slope = hum_slope
+        self.calm_samples = calm_samples
+        self.window_ms = window_ms
+        self.gas_floor = gas_floor
+        self.hum_floor = hum_floor
+        self.interval_ms = base_ms
+        self.deadline = time.ticks_ms()
+        self.late = 0          # deadlines missed by more than a whole interval
+        self._calm = 0
+        self._last_ticks = None
+        self._gas = 0.0        # exponential moving averages (time constant window_ms)
+        self._hum = 0.0
+
+    def observe(self, gas, hum):
+        """
+        Adjust the interval from the change against the smoothed baseline.
+
+        For a steady trend the distance from an exponential moving average
+        settles at slope * window_ms whatever the sampling interval, while
+        sample-to-sample noise stays at its own size, so a short interval does
+        not make noise look like a fast change.
+
+        Returns:
+            True if the readings are changing quickly
+        """
+        now = time.ticks_ms()
+        fast = False
+        if self._last_ticks is None:
+            self._gas = gas
+            self._hum = hum
+        else:
+            elapsed = time.ticks_diff(now, self._last_ticks)
+            if elapsed > 0:
+                gas_dev = abs(gas - self._gas) / max(self._gas, 1)
+                hum_dev = abs(hum - self._hum)
+                minutes = self.window_ms / 60000
+                fast = (gas_dev > self.gas_floor and gas_dev / minutes > self.gas_slope) or \
+                       (hum_dev > self.hum_floor and hum_dev / minutes > self.hum_slope)
+                k = min(elapsed / self.window_ms, 1.0)
+                self._gas += k * (gas - self._gas)
+                self._hum += k * (hum - self._hum)
+        self._last_ticks = now
+        if fast:
+            self.interval_ms = self.min_ms
+            self._calm = 0
+        else:
+            self._calm += 1
+            if self._calm >= self.calm_samples and self.interval_ms < self.max_ms:
+                self.interval_ms = min(self.interval_ms * 2, self.max_ms)
+                self._calm = 0
+        return fast
+
+    def advance(self):
+        """
+        Move to the next deadline, one interval after the previous one, so that
+        time spent sampling does not shift the schedule.
+
+        Returns:
+            Milliseconds until the next deadline
+        """
+        now = time.ticks_ms()
+        self.deadline = time.ticks_add(self.deadline, self.interval_ms)
+        delay = time.ticks_diff(self.deadline, now)
+        if delay < -self.interval_ms:
+            # Too far behind to catch up: skip the missed slots instead of bursting
+            self.late += 1
+            self.deadline = now
+            delay = 0
+        return max(delay, 0)
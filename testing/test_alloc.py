@@ -0,0 +1,171 @@
+"""
+Heap Allocation Test - Run on the Pico W (copy the project files first, then
+e.g. `mpremote run testing/test_alloc.py`)
+Measures the bytes allocated per sample by each step of the steady-state
+sampling path in main.py, and by the whole per-sample path end to end, and
+checks them against a budget
+"""
+
+import gc
+import os
+import struct
+import time
+from machine import I2C, Pin, ADC
+from bme680 import BME680_I2C
+import lcd_driver
+from ring_log import RingLog, RECORD_FMT
+from firebase_sync import READING_SCHEMA
+from reading import (Reading, RecordQueue, update_reading, lcd_time_line,
+                     lcd_air_line, json_into)
+from textbuf import TextBuffer
+from history import History
+from metrics import Metrics
+from compress import Compressor
+from rollup import Rollup
+
+SAMPLES = 20
+TEST_LOG = "alloc_test.log"
+TEST_MINUTES = "alloc_test_min.log"
+TEST_HOURS = "alloc_test_hour.log"
+
+# Bytes per sample. Floats are heap objects on the rp2 port, so steps doing
+# float arithmetic (compensation, rounding) cannot be allocation-free; the
+# budgets leave room for those and for the one time tuple or unpacked record a
+# step needs, not for strings, dicts or further tuples.
+BUDGETS = {
+    "sensor": 2048,   # BME680 compensation maths
+    "record": 32,
+    "queue": 0,
+    "lcd": 160,       # fixed() rounding, one memoryview per changed run
+    "json": 256,
+    "log": 64,        # file seek/write
+    "upload": 256,    # one Firestore document: localtime tuple, fixed() rounding
+    # A whole sampling period as main.py runs it: update_reading (IAQ maths, the
+    # local time tuple), sample_taken and one persistence pass (the record
+    # unpacked once, ~10 floats per field in the compressor and 3 per field in
+    # each rollup): about 1.5 KB, plus the amortized bucket and log writes
+    "sample": 2048,
+}
+
+
+def measure(fn, samples=SAMPLES):
+    """Average bytes allocated per call of fn(), with the GC off so nothing is freed"""
+    fn()  # warm up: first calls may create lazily allocated state
+    gc.collect()
+    gc.disable()
+    try:
+        before = gc.mem_alloc()
+        for _ in range(samples):
+            fn()
+        return (gc.mem_alloc() - before) // samples
+    finally:
+        gc.enable()
+
+
+def test_allocations():
+    print("=" * 60)
+    print("Sampling Path - Heap Allocation Test")
+    print("=" * 60)
+
+    i2c = I2C(0, sda=Pin(0), scl=Pin(1), freq=100000)
+    lcd_driver.lcd_init(i2c)
+    bme = BME680_I2C(i2c, address=0x77)
+
+    reading = Reading()
+    queue = RecordQueue()
+    line = TextBuffer(lcd_driver.LCD_WIDTH)
+    out = TextBuffer(256)
+    body = TextBuffer(1024)
+    log = RingLog(TEST_LOG, capacity=64)
+    local = time.localtime()
+    snapshot = [bme.read_all()]
+
+    def sensor():
+        bme.start_measurement()
+        while True:
+            s = bme.collect()
+            if s:
+                snapshot[0] = s
+                return
+            time.sleep_ms(5)
+
+    def record():
+        s = snapshot[0]
+        reading.update(local, 0, s.temperature, s.humidity, s.pressure, s.gas, 0)
+
+    def enqueue():
+        queue.push(reading.record)
+        queue.pop()
+
+    def lcd():
+        lcd_driver.lcd_write_line(i2c, 0, lcd_time_line(line, reading.local).buf)
+        lcd_driver.lcd_write_line(i2c, 1, lcd_air_line(line, reading).buf)
+
+    def json():
+        json_into(out, reading, local, 1234, 27.5, True)
+
+    def append():
+        log.append_packed(reading.record)
+
+    history = History(64)
+    stats = Metrics()
+    chip_adc = ADC(4)
+    compressor = Compressor({"temp": (0.1, 0), "hum": (0.5, 0),
+                             "pres": (0.1, 0), "gas": (0, 0.02)})
+    minutes = Rollup(60, TEST_MINUTES, 16)
+    hours = Rollup(3600, TEST_HOURS, 16)
+    system = {}
+    clock = [time.time()]
+
+    def sample():
+        # main.py sampler_task + persistence_task for one reading, without the
+        # network and LCD (measured above); the clock advances one 6 s period
+        # so rollup buckets close and their records are written as on the device
+        clock[0] += 6
+        now = clock[0]
+        update_reading(reading, snapshot[0], now)
+        queue.push(reading.record)
+        history.append(reading.ts, reading.temp, reading.hum, reading.pres,
+                       reading.gas, reading.iaq)
+        system["utc"] = now
+        system["chip_temp"] = 27 - (chip_adc.read_u16() * 3.3 / 65535 - 0.706) / 0.001721
+        stats.sample_memory()
+        while len(queue):
+            record = queue.peek()
+            values = struct.unpack(RECORD_FMT, record)
+            compressor.add(record, values, log.append_packed)
+            minutes.add(values)
+            hours.add(values)
+            queue.pop()
+
+    uploaded = struct.unpack(RECORD_FMT, reading.record)
+
+    def upload():
+        READING_SCHEMA.document_into(body.clear(), uploaded)
+
+    steps = (("sensor", sensor), ("record", record), ("queue", enqueue),
+             ("lcd", lcd), ("json", json), ("log", append), ("upload", upload),
+             ("sample", sample))
+    ok = True
+    try:
+        for name, fn in steps:
+            used = measure(fn)
+            passed = used <= BUDGETS[name]
+            ok = ok and passed
+            print(f"{'✓' if passed else '❌'} {name:8s} {used:5d} bytes/sample (budget {BUDGETS[name]})")
+    finally:
+        log.close()
+        minutes.log.close()
+        hours.log.close()
+        for path in (TEST_LOG, TEST_MINUTES, TEST_HOURS):
+            os.remove(path)
+
+    return ok
+
+
+if __name__ == "__main__":
+    success = test_allocations()
+
+    print("\n" + "=" * 60)
+    print("Test Complete!" if success else "Test FAILED: allocation budget exceeded")
+    print("=" * 60)
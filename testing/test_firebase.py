@@ -4,8 +4,17 @@ This script simulates what the Pico W will do when syncing data
 """
 
 import json
+import os
+import sys
+import time
 import requests
-from datetime import datetime
+from datetime import datetime, timedelta
+
+# Share the document layout with the Pico (firebase_sync.py in the project root)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from firebase_sync import READING_SCHEMA
+from dst import local_epoch
+from textbuf import TextBuffer
 
 def test_firestore_connection():
     """Test Firestore connection and data upload"""
@@ -36,30 +45,17 @@ def test_firestore_connection():
     print(f"✓ API Key: {api_key[:20]}...")
     print()
     
-    # Create test data (similar to what Pico W sends)
-    test_data = {
-        "timestamp": datetime.now().strftime("%Y-%m-%dT%H:%M:%S"),
-        "temperature_C": 22.8,
-        "humidity_%": 44.6,
-        "pressure_hPa": 1012.4,
-        "gas_ohms": 11690
-    }
+    # Create a test reading as the Pico logs it: (utc_ts, temp, hum, pres, gas, iaq_code)
+    test_record = (int(time.time()), 22.8, 44.6, 1012.4, 11690, 0)
+    
+    # Convert to Firestore format with the same schema the Pico uses
+    body = READING_SCHEMA.document_into(TextBuffer(1024), test_record)
+    firestore_data = json.loads(bytes(body.view()))
     
     print("Test data to upload:")
-    print(json.dumps(test_data, indent=2))
+    print(json.dumps(firestore_data, indent=2))
     print()
     
-    # Convert to Firestore format
-    firestore_data = {
-        "fields": {
-            "timestamp": {"stringValue": test_data["timestamp"]},
-            "temperature_C": {"doubleValue": test_data["temperature_C"]},
-            "humidity_percent": {"doubleValue": test_data["humidity_%"]},
-            "pressure_hPa": {"doubleValue": test_data["pressure_hPa"]},
-            "gas_ohms": {"integerValue": str(test_data["gas_ohms"])}
-        }
-    }
-    
     # Construct Firestore URL
     url = f"https://firestore.googleapis.com/v1/projects/{project_id}/databases/(default)/documents/air_quality_readings?key={api_key}"
     
@@ -148,11 +144,9 @@ def read_firestore_data():
                 doc_id = doc.get('name', '').split('/')[-1]
                 
                 print(f"Document ID: {doc_id}")
-                print(f"  Timestamp: {fields.get('timestamp', {}).get('stringValue', 'N/A')}")
-                print(f"  Temperature: {fields.get('temperature_C', {}).get('doubleValue', 'N/A')} °C")
-                print(f"  Humidity: {fields.get('humidity_percent', {}).get('doubleValue', 'N/A')} %")
-                print(f"  Pressure: {fields.get('pressure_hPa', {}).get('doubleValue', 'N/A')} hPa")
-                print(f"  Gas: {fields.get('gas_ohms', {}).get('integerValue', 'N/A')} Ω")
+                for name in READING_SCHEMA.names:
+                    value = _value(fields[name]) if name in fields else 'N/A'
+                    print(f"  {name}: {value}")
                 print()
         else:
             print(f"❌ Failed to read data: HTTP {response.status_code}")
@@ -161,6 +155,88 @@ def read_firestore_data():
     except Exception as e:
         print(f"❌ Error reading data: {e}")
 
+def _value(v):
+    """Plain Python value of a Firestore typed value"""
+    if "integerValue" in v:
+        return int(v["integerValue"])
+    if "doubleValue" in v:
+        return v["doubleValue"]
+    if "arrayValue" in v:
+        return [_value(x) for x in v["arrayValue"].get("values", [])]
+    return v.get("stringValue")
+
+def read_hourly_data(project_id, api_key, device_id, hours=24, collection="air_quality_hourly"):
+    """
+    Read the last `hours` hour documents written by FirebaseSync.send_hourly
+    (one batchGet request, one document read per hour).
+
+    Returns:
+        List of (local datetime, {column: value}) in time order
+    """
+    prefix = f"projects/{project_id}/databases/(default)/documents/{collection}/"
+    # Hour IDs are in the Pico's local time (Finland, with DST), not this computer's,
+    # followed by the UTC offset (the hour repeated when DST ends has two documents)
+    now = int(time.time())
+    now -= now % 3600
+    names = []
+    for h in reversed(range(hours)):
+        utc = now - h * 3600
+        local = local_epoch(utc)
+        names.append(prefix + device_id + time.strftime("_%Y%m%dT%H", time.gmtime(local)) +
+                     "+%02d" % ((local - utc) // 3600))
+    url = f"https://firestore.googleapis.com/v1/projects/{project_id}/databases/(default)/documents:batchGet?key={api_key}"
+    response = requests.post(url, json={"documents": names}, timeout=10)
+    response.raise_for_status()
+
+    rows = []
+    for result in response.json():
+        doc = result.get("found")
+        if not doc:
+            continue  # no readings in that hour
+        fields = doc["fields"]
+        start = datetime.strptime(_value(fields["hour"]), "%Y-%m-%dT%H:%M:%S")
+        columns = _value(fields["columns"])
+        hour_rows = fields.get("r", {}).get("mapValue", {}).get("fields", {})
+        for offset in sorted(hour_rows, key=int):
+            rows.append((start + timedelta(seconds=int(offset)), dict(zip(columns, _value(hour_rows[offset])))))
+    return rows  # documents were requested oldest first
+
+def show_hourly_data():
+    """Read and summarize the last 24 hour documents of the device in firebase_config.json"""
+    
+    print("\n" + "=" * 60)
+    print("Reading hour documents from Firestore...")
+    print("=" * 60 + "\n")
+    
+    try:
+        with open("firebase_config.json", "r") as f:
+            config = json.load(f)
+            project_id = config.get("project_id")
+            api_key = config.get("api_key")
+            device_id = config.get("device_id")
+    except:
+        print("❌ Cannot read firebase_config.json")
+        return
+    
+    if not device_id:
+        print("Add \"device_id\" (printed by the Pico at boot) to firebase_config.json to read hour documents")
+        return
+    
+    try:
+        rows = read_hourly_data(project_id, api_key, device_id)
+    except Exception as e:
+        print(f"❌ Error reading hour documents: {e}")
+        return
+    
+    if not rows:
+        print("No hour documents found for the last 24 hours.")
+        return
+    
+    print(f"{len(rows)} readings from {rows[0][0]} to {rows[-1][0]}\n")
+    for when, values in rows[-5:]:
+        print(f"  {when}: {values.get('temperature_C')} °C, {values.get('humidity_percent')} %, "
+              f"{values.get('pressure_hPa')} hPa, {values.get('gas_ohms')} Ω")
+
 if __name__ == "__main__":
     # Test connection and upload
     success = test_firestore_connection()
@@ -168,6 +244,7 @@ if __name__ == "__main__":
     # If successful, also try reading data
     if success:
         read_firestore_data()
+        show_hourly_data()
     
     print("\n" + "=" * 60)
     print("Test Complete!")
@@ -0,0 +1,81 @@
+# textbuf.py
+# Preallocated byte buffer for building short text (LCD lines, JSON) in place,
+# so that periodic formatting does not create new strings on the heap
+
+_POW10 = (1, 10, 100, 1000, 10000, 100000, 1000000)
+
+
+class TextBuffer:
+    def __init__(self, size):
+        """
+        Fixed-size text buffer. Appends beyond `size` bytes are dropped.
+
+        Args:
+            size: Capacity in bytes
+        """
+        self.buf = bytearray(size)
+        self.mv = memoryview(self.buf)
+        self.size = size
+        self.n = 0
+
+    def clear(self):
+        self.n = 0
+        return self
+
+    def text(self, data):
+        """Append bytes (bytes, bytearray or memoryview)"""
+        buf = self.buf
+        n = self.n
+        for b in data:
+            if n == self.size:
+                break
+            buf[n] = b
+            n += 1
+        self.n = n
+        return self
+
+    def integer(self, value, width=0):
+        """Append an integer in decimal, zero-padded to `width` digits"""
+        if value < 0:
+            self.text(b"-")
+            value = -value
+        digits = 1
+        v = value
+        while v >= 10:
+            v //= 10
+            digits += 1
+        if digits < width:
+            digits = width
+        start = self.n
+        i = start + digits - 1
+        while i >= start:
+            if i < self.size:
+                self.buf[i] = 48 + value % 10
+            value //= 10
+            i -= 1
+        self.n = min(start + digits, self.size)
+        return self
+
+    def fixed(self, value, decimals):
+        """Append a number rounded to `decimals` places (like "%.2f")"""
+        if value < 0:
+            self.text(b"-")
+            value = -value
+        scale = _POW10[decimals]
+        scaled = int(value * scale + 0.5)
+        self.integer(scaled // scale)
+        if decimals:
+            self.text(b".")
+            self.integer(scaled % scale, decimals)
+        return self
+
+    def pad(self, fill=32):
+        """Fill the rest of the buffer (default: spaces), e.g. for a full LCD line"""
+        while self.n < self.size:
+            self.buf[self.n] = fill
+            self.n += 1
+        return self
+
+    def view(self):
+        """Memoryview of the text written so far (valid until the next change)"""
+        return self.mv[:self.n]
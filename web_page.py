@@ -0,0 +1,73 @@
+# web_page.py
+# Static dashboard shell served at "/". Built once as bytes (and gzip-compressed
+# when the firmware supports it); the page fills in its values from the /events
+# stream, or by polling /data if that is not available.
+
+INDEX_HTML = (
+    b'<!DOCTYPE html><html><head><meta charset="utf-8"><title>Pico W Dashboard</title>'
+    b'<style>'
+    b'body{font-family:Arial,Helvetica,sans-serif;background:#f5f7fb;padding:20px;color:#111}'
+    b'table{border-collapse:collapse;width:480px;background:#fff;margin-bottom:16px}'
+    b'th,td{border:1px solid #e5e7eb;padding:8px 10px;text-align:left}'
+    b'th{background:#f9fafb}'
+    b'.sub{color:#6b7280;margin-bottom:12px}'
+    b'</style></head><body>'
+    b'<h1>Pico W System Dashboard</h1>'
+    b'<div class="sub">Local: <span id="local">--</span></div>'
+    b'<table>'
+    b'<tr><th>Field</th><th>Value</th></tr>'
+    b'<tr><td>Temperature</td><td><span id="temp">--</span> &deg;C</td></tr>'
+    b'<tr><td>Humidity</td><td><span id="hum">--</span> %</td></tr>'
+    b'<tr><td>Pressure</td><td><span id="pres">--</span> hPa</td></tr>'
+    b'<tr><td>Air quality</td><td id="iaq">--</td></tr>'
+    b'<tr><td>UTC time</td><td id="utc">--</td></tr>'
+    b'<tr><td>Uptime (sec)</td><td id="uptime">--</td></tr>'
+    b'<tr><td>Chip temperature</td><td><span id="chip_temp">--</span> &deg;C</td></tr>'
+    b'</table>'
+    b'<form action="/reboot" method="get" onsubmit="return confirm(\'Reboot Pico W now?\');" style="margin-top:12px">'
+    b'<button type="submit" style="padding:8px 12px;background:#ef4444;color:#fff;border:none;border-radius:6px;cursor:pointer;">'
+    b'Reboot device</button></form>'
+    b'<script>'
+    b'function show(d){if(!d.time)return;'
+    b'var t=d.time.split("T"),p=t[0].split("-");'
+    b'document.getElementById("local").textContent=t[1]+" \\u2014 "+p[2]+"-"+p[1]+"-"+p[0];'
+    b'["temp","hum","pres","iaq","utc","uptime","chip_temp"].forEach(function(k){'
+    b'document.getElementById(k).textContent=d[k];});}'
+    b'function poll(){fetch("/data",{cache:"no-cache"}).then(function(r){return r.json();})'
+    b'.then(show).catch(function(){});}'
+    b'if(window.EventSource){var es=new EventSource("/events");'
+    b'es.onmessage=function(e){show(JSON.parse(e.data));};'
+    b'es.onerror=function(){if(es.readyState===2){poll();setInterval(poll,10000);}};}'
+    b'else{poll();setInterval(poll,10000);}'
+    b'</script>'
+    b'</body></html>'
+)
+
+REBOOT_HTML = (
+    b"<html><head><meta charset='utf-8'><title>Rebooting</title></head>"
+    b"<body><h1>Rebooting...</h1></body></html>"
+)
+
+
+def _gzip(data):
+    """Gzip-compress data, or return None if this firmware cannot compress"""
+    try:
+        import deflate, io
+        buf = io.BytesIO()
+        with deflate.DeflateIO(buf, deflate.GZIP) as f:
+            f.write(data)
+        return buf.getvalue()
+    except Exception:
+        return None
+
+
+def _etag(data):
+    try:
+        from binascii import crc32
+        return '"%08x"' % crc32(data)
+    except ImportError:
+        return '"%d"' % len(data)
+
+
+INDEX_HTML_GZ = _gzip(INDEX_HTML)
+INDEX_ETAG = _etag(INDEX_HTML)
@@ -0,0 +1,298 @@
+# web_server.py
+# Small non-blocking HTTP/1.1 server on uasyncio: concurrent clients, keep-alive
+# connections and path routing
+
+import uasyncio as asyncio
+
+_REASONS = {200: "OK", 204: "No Content", 304: "Not Modified", 400: "Bad Request",
+            404: "Not Found", 405: "Method Not Allowed", 503: "Service Unavailable"}
+
+
+class Request:
+    def __init__(self, method, path, query, version, headers, body):
+        self.method = method
+        self.path = path
+        self.query = query          # dict of query string parameters (str values)
+        self.version = version
+        self.headers = headers      # dict with lower-case header names
+        self.body = body
+        if version == "HTTP/1.1":
+            self.keep_alive = headers.get("connection", "").lower() != "close"
+        else:
+            self.keep_alive = headers.get("connection", "").lower() == "keep-alive"
+
+
+class Response:
+    def __init__(self, writer, keep_alive):
+        self.writer = writer
+        self.keep_alive = keep_alive
+        self.status = None
+
+    def _head(self, status, content_type, headers, length=None):
+        head = "HTTP/1.1 %d %s\r\n" % (status, _REASONS.get(status, ""))
+        if content_type:
+            head += "Content-Type: %s\r\n" % content_type
+        if length is not None:
+            head += "Content-Length: %d\r\n" % length
+        if headers:
+            for name in headers:
+                head += "%s: %s\r\n" % (name, headers[name])
+        head += "Connection: %s\r\n\r\n" % ("keep-alive" if self.keep_alive else "close")
+        self.status = status
+        return head.encode()
+
+    async def send(self, body=b"", status=200, content_type="text/html; charset=utf-8", headers=None):
+        """
+        Send a complete response with Content-Length framing.
+
+        Args:
+            body: Response body (str or bytes)
+            status: HTTP status code
+            content_type: Content-Type header value (None to omit)
+            headers: Optional dict of extra headers
+        """
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        self.writer.write(self._head(status, content_type, headers, len(body)))
+        if body:
+            self.writer.write(body)
+        await self.writer.drain()
+
+    async def send_cached(self, request, body, etag, content_type="text/html; charset=utf-8",
+                          headers=None, gzip_body=None):
+        """
+        Send a response with an ETag, or an empty 304 if the client already has it.
+
+        Args:
+            request: The Request being answered (for If-None-Match / Accept-Encoding)
+            body: Response body, or a function returning it (only called when needed)
+            etag: Quoted entity tag for this body
+            content_type: Content-Type header value
+            headers: Optional dict of extra headers
+            gzip_body: Optional gzip-compressed body, sent to clients that accept gzip
+        """
+        h = {"ETag": etag}
+        if headers:
+            h.update(headers)
+        if request.headers.get("if-none-match") == etag:
+            await self.send(b"", 304, None, h)
+            return
+        if gzip_body is not None and "gzip" in request.headers.get("accept-encoding", ""):
+            h["Content-Encoding"] = "gzip"
+            h["Vary"] = "Accept-Encoding"
+            body = gzip_body
+        elif callable(body):
+            body = body()
+        await self.send(body, 200, content_type, h)
+
+    async def start_stream(self, status=200, content_type="text/event-stream", headers=None):
+        """Send headers for an open-ended body that ends when the connection closes"""
+        self.keep_alive = False
+        self.writer.write(self._head(status, content_type, headers))
+        await self.writer.drain()
+
+    async def start_chunked(self, status=200, content_type="text/plain", headers=None):
+        """Send headers for a response whose body follows in write_chunk() calls"""
+        h = {"Transfer-Encoding": "chunked"}
+        if headers:
+            h.update(headers)
+        self.writer.write(self._head(status, content_type, h))
+        await self.writer.drain()
+
+    async def write_chunk(self, data):
+        """Send one chunk of a chunked response (empty data is ignored)"""
+        if data:
+            self.writer.write(("%x\r\n" % len(data)).encode())
+            self.writer.write(data)
+            self.writer.write(b"\r\n")
+            await self.writer.drain()
+
+    async def end_chunked(self):
+        self.writer.write(b"0\r\n\r\n")
+        await self.writer.drain()
+
+
+def _unquote(s):
+    """Decode %XX escapes and '+' in a query string component"""
+    if "%" not in s and "+" not in s:
+        return s
+    s = s.replace("+", " ")
+    parts = s.split("%")
+    out = [parts[0]]
+    for part in parts[1:]:
+        try:
+            out.append(chr(int(part[:2], 16)) + part[2:])
+        except ValueError:
+            out.append("%" + part)
+    return "".join(out)
+
+
+def parse_query(qs):
+    query = {}
+    for pair in qs.split("&"):
+        if pair:
+            name, _, value = pair.partition("=")
+            query[_unquote(name)] = _unquote(value)
+    return query
+
+
+class WebServer:
+    def __init__(self, port=80, max_clients=6, idle_timeout=10, max_body=1024):
+        """
+        HTTP server handling several connections at once.
+
+        Args:
+            port: TCP port to listen on
+            max_clients: Connections served at the same time; more get 503
+            idle_timeout: Seconds a keep-alive connection may wait for its next request
+            max_body: Largest accepted request body in bytes
+        """
+        self.port = port
+        self.max_clients = max_clients
+        self.idle_timeout = idle_timeout
+        self.max_body = max_body
+        self.routes = {}
+        self.clients = 0
+        self.requests = 0
+        self._server = None
+
+    def route(self, path, handler):
+        """
+        Register a handler for a path.
+
+        Args:
+            path: Exact request path (e.g., "/data")
+            handler: async function handler(request, response)
+        """
+        self.routes[path] = handler
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, "0.0.0.0", self.port, backlog=self.max_clients)
+
+    async def _read_request(self, reader):
+        line = await reader.readline()
+        if not line or line == b"\r\n":
+            return None
+        method, target, version = line.decode().split()
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if not line or line == b"\r\n":
+                break
+            name, _, value = line.decode().partition(":")
+            headers[name.strip().lower()] = value.strip()
+        body = b""
+        length = int(headers.get("content-length", 0))
+        if length:
+            if length > self.max_body:
+                raise ValueError("request body too large")
+            body = await reader.readexactly(length)
+        path, _, qs = target.partition("?")
+        return Request(method, path, parse_query(qs), version, headers, body)
+
+    async def _serve(self, reader, writer):
+        if self.clients >= self.max_clients:
+            try:
+                await Response(writer, False).send("Busy", 503, "text/plain")
+            except Exception:
+                pass
+            writer.close()
+            await writer.wait_closed()
+            return
+        self.clients += 1
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(self._read_request(reader), self.idle_timeout)
+                except (ValueError, IndexError):
+                    await Response(writer, False).send("Bad Request", 400, "text/plain")
+                    break
+                if request is None:
+                    break
+                self.requests += 1
+                response = Response(writer, request.keep_alive)
+                handler = self.routes.get(request.path)
+                if handler is None:
+                    await response.send("Not Found", 404, "text/plain")
+                else:
+                    await handler(request, response)
+                if not response.keep_alive:
+                    break
+        except (asyncio.TimeoutError, OSError):
+            pass
+        except Exception as e:
+            print("HTTP client error:", e)
+        finally:
+            self.clients -= 1
+            writer.close()
+            await writer.wait_closed()
+
+
+class _Subscriber:
+    def __init__(self, writer):
+        self.writer = writer
+        self.event = asyncio.Event()
+
+
+class EventStream:
+    def __init__(self, max_subscribers=4, send_timeout_ms=2000, keepalive_ms=15000, current=None):
+        """
+        Server-Sent Events broadcaster. Register `handler` as a route and call
+        `publish` with each new message.
+
+        Args:
+            max_subscribers: Open streams allowed at once; more get 503
+            send_timeout_ms: A subscriber that cannot take a message within this time is dropped
+            keepalive_ms: Idle time after which a comment line is sent to detect dead clients
+            current: Optional function returning the current message (str or bytes), sent
+                to the first subscriber since publishing may have been skipped
+                while there were none
+        """
+        self.max_subscribers = max_subscribers
+        self.send_timeout_ms = send_timeout_ms
+        self.keepalive_ms = keepalive_ms
+        self.subscribers = []
+        self.dropped = 0
+        self._message = None
+        self._id = 0
+        self._current = current
+
+    def publish(self, data):
+        """Push a message (str or bytes-like) to all subscribers. Slow subscribers only get the newest one."""
+        self._id += 1
+        if isinstance(data, str):
+            data = data.encode()
+        self._message = ("id: %d\ndata: " % self._id).encode() + bytes(data) + b"\n\n"
+        for sub in self.subscribers:
+            sub.event.set()
+
+    async def handler(self, request, response):
+        if len(self.subscribers) >= self.max_subscribers:
+            await response.send("Too many subscribers", 503, "text/plain")
+            return
+        await response.start_stream(headers={"Cache-Control": "no-cache",
+                                             "Access-Control-Allow-Origin": "*"})
+        if self._current and not self.subscribers:
+            # Nothing was published while nobody listened: start from the current value
+            self.publish(self._current())
+        sub = _Subscriber(response.writer)
+        self.subscribers.append(sub)
+        if self._message:
+            sub.event.set()  # send the current value straight away
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for_ms(sub.event.wait(), self.keepalive_ms)
+                    sub.event.clear()
+                    sub.writer.write(self._message)
+                except asyncio.TimeoutError:
+                    sub.writer.write(b": ping\n\n")
+                try:
+                    await asyncio.wait_for_ms(sub.writer.drain(), self.send_timeout_ms)
+                except asyncio.TimeoutError:
+                    self.dropped += 1
+                    break
+        except OSError:
+            pass
+        finally:
+            self.subscribers.remove(sub)